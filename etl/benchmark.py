@@ -0,0 +1,574 @@
+"""Offline benchmark of the parse, join and load stages.
+
+Raw API responses are replayed from fixtures recorded with
+HTTP_REPLAY_MODE=record, scaled up and loaded into mongomock
+or a local mongod, so throughput and memory regressions can be
+caught without network access.
+
+Micro-benchmarks of single stages run on synthetic data and
+need no fixtures: join (show-to-channel join), datetime (show
+time parsing), insert (batched writes) and parse (mongoengine
+documents against slotted records), sized by channel count.
+
+Usage:
+    HTTP_REPLAY_MODE=replay python benchmark.py [scale ...]
+    python benchmark.py join|datetime|insert|parse [channels ...]
+"""
+import gzip
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from xml.etree import ElementTree
+
+import bson
+import pendulum
+from decouple import config
+from mongoengine import connect
+
+from orm.models import Channel, Reference, ScheduledShow, Show, Snapshot
+from scrapers.mts import MTS
+from scrapers.sbb import SBB
+from services.db import Database
+from services.export import Export, pyarrow
+from services.lookup import Lookup
+from utils import constants, helpers
+from utils.parsers import ParserMTS
+from utils.validator import Validator
+
+# Raw channel and show keys holding channel ids
+ID_KEYS = {"mts": ("id", "id_channel"), "sbb": ("id", "channelId")}
+
+# Channel id offset between copies of a scaled dataset
+ID_OFFSET = 10**6
+
+
+def scale(provider: str, data: dict, factor: int) -> dict:
+    """Replicate raw channels and shows factor times under new channel ids.
+
+    Args:
+        provider (str): Provider name
+        data (dict): Raw channels and shows
+        factor (int): Number of copies
+
+    Returns:
+        dict: Scaled raw channels and shows
+    """
+    channel_key, show_key = ID_KEYS[provider]
+    scaled = {"channels": [], "shows": []}
+
+    for copy in range(factor):
+        offset = copy * ID_OFFSET
+
+        for item in data["channels"]:
+            value = item[channel_key]
+            scaled["channels"].append({**item, channel_key: type(value)(int(value) + offset)})
+
+        for item in data["shows"]:
+            value = item.get(show_key, 0)
+            scaled["shows"].append({**item, show_key: type(value)(int(value) + offset)})
+
+    return scaled
+
+
+def measure(func, *args) -> tuple:
+    """Run function, measuring wall time and peak traced memory.
+
+    Returns:
+        tuple: Result, seconds and peak memory in MB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, elapsed, peak / 2**20)
+
+
+def timed(func, *args) -> tuple:
+    """Run function, measuring wall time only, tracing memory skews fast stages.
+
+    Returns:
+        tuple: Result and seconds
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return (result, time.perf_counter() - start)
+
+
+def report_cost(stage: str, factor: int, records: int, elapsed: float) -> None:
+    print(
+        f"{ stage:<10} { factor:>4}x { records:>9} records "
+        f"{ elapsed:>8.3f}s { elapsed / max(records, 1) * 1e6:>10.2f} us/record"
+    )
+
+
+def report(stage: str, factor: int, records: int, elapsed: float, peak: float) -> None:
+    rate = records / elapsed if elapsed else 0
+    print(
+        f"{ stage:<10} { factor:>4}x { records:>9} records "
+        f"{ elapsed:>8.3f}s { rate:>10.0f}/s { peak:>8.1f} MB"
+    )
+
+
+def now_playing_embedded(now: int) -> list:
+    """Shows on air at now, filtered out of embedded channel shows."""
+    return list(
+        Channel._get_collection().aggregate(
+            [
+                {"$match": {"shows.start_ts": {"$lte": now}}},
+                {
+                    "$project": {
+                        "name": 1,
+                        "shows": {
+                            "$filter": {
+                                "input": "$shows",
+                                "as": "show",
+                                "cond": {
+                                    "$and": [
+                                        {"$lte": ["$$show.start_ts", now]},
+                                        {"$gt": ["$$show.end_ts", now]},
+                                    ]
+                                },
+                            }
+                        },
+                    }
+                },
+            ]
+        )
+    )
+
+
+def now_playing_flat(now: int) -> list:
+    """Shows on air at now, looked up in the flattened show collection."""
+    return list(
+        ScheduledShow._get_collection().find(
+            {"start_ts": {"$lte": now}, "end_ts": {"$gt": now}}
+        )
+    )
+
+
+def report_size(stage: str, factor: int, path: str) -> None:
+    print(f"{ stage:<10} { factor:>4}x { os.path.getsize(path) / 2**10:>9.1f} KB on disk")
+
+
+def report_bytes(stage: str, factor: int, size: int, shows: int) -> None:
+    print(
+        f"{ stage:<10} { factor:>4}x { size / 2**10:>9.1f} KB BSON "
+        f"{ size / max(shows, 1):>8.1f} B/show"
+    )
+
+
+def compare_compaction(factor: int, channels: list) -> None:
+    """Compare BSON size of channel documents with and without compacted shows."""
+    shows = sum(len(channel.shows) for channel in channels)
+    docs = [channel.to_mongo() for channel in channels]
+    report_bytes("full", factor, sum(len(bson.encode(doc)) for doc in docs), shows)
+
+    enabled = Lookup._ENABLED
+    Lookup._ENABLED = True
+
+    try:
+        compact, elapsed, peak = measure(lambda: [Database._to_mongo(doc) for doc in docs])
+    finally:
+        Lookup._ENABLED = enabled
+
+    report("compact", factor, shows, elapsed, peak)
+    report_bytes("compact", factor, sum(len(bson.encode(doc)) for doc in compact), shows)
+    references = list(Reference._get_collection().find({}, {"_id": 0}))
+    report_bytes("refs", factor, sum(len(bson.encode(doc)) for doc in references), shows)
+
+
+def dump_channels(path: str) -> int:
+    """Write stored channels as gzip compressed BSON, like mongodump --gzip."""
+    count = 0
+
+    with gzip.open(path, "wb") as file:
+        for doc in Channel._get_collection().find():
+            file.write(bson.encode(doc))
+            count += 1
+
+    return count
+
+
+def read_dump(path: str) -> int:
+    """Decode all shows of a channel dump."""
+    with gzip.open(path, "rb") as file:
+        return sum(len(doc["shows"]) for doc in bson.decode_all(file.read()))
+
+
+def read_mongo() -> int:
+    """Read all shows of stored channels."""
+    return sum(len(doc["shows"]) for doc in Channel._get_collection().find())
+
+
+def read_xmltv(path: str) -> int:
+    """Parse all programmes of an XMLTV export."""
+    count = 0
+
+    with gzip.open(path, "rb") as file:
+        for _, element in ElementTree.iterparse(file):
+            if element.tag == "programme":
+                count += 1
+                element.clear()
+
+    return count
+
+
+def read_parquet(path: str) -> int:
+    """Read all shows of a Parquet export."""
+    return pyarrow.parquet.read_table(path).num_rows
+
+
+def compare_exports(factor: int, channels: list) -> None:
+    """Compare export file sizes and full read times against a Mongo dump."""
+    with tempfile.TemporaryDirectory() as directory:
+        dump = os.path.join(directory, "channel.bson.gz")
+        xmltv = os.path.join(directory, "epg.xml.gz")
+        parquet = os.path.join(directory, "epg.parquet")
+
+        count, elapsed, peak = measure(dump_channels, dump)
+        report("dump", factor, count, elapsed, peak)
+        report_size("dump", factor, dump)
+
+        count, elapsed, peak = measure(Export.write_xmltv, channels, xmltv)
+        report("xmltv", factor, count, elapsed, peak)
+        report_size("xmltv", factor, xmltv)
+
+        if pyarrow is not None:
+            count, elapsed, peak = measure(Export.write_parquet, channels, parquet)
+            report("parquet", factor, count, elapsed, peak)
+            report_size("parquet", factor, parquet)
+
+        count, elapsed, peak = measure(read_mongo)
+        report("read.mongo", factor, count, elapsed, peak)
+
+        count, elapsed, peak = measure(read_dump, dump)
+        report("read.dump", factor, count, elapsed, peak)
+
+        count, elapsed, peak = measure(read_xmltv, xmltv)
+        report("read.xmltv", factor, count, elapsed, peak)
+
+        if pyarrow is not None:
+            count, elapsed, peak = measure(read_parquet, parquet)
+            report("read.pq", factor, count, elapsed, peak)
+
+
+def day_embedded(start: int, end: int, category: str = None) -> list:
+    """Channels with their shows of a day, filtered out of embedded channel shows."""
+    match = {"category": category} if category else {}
+    return list(
+        Channel._get_collection().aggregate(
+            [
+                {"$match": match},
+                {
+                    "$project": {
+                        "oid": 1,
+                        "name": 1,
+                        "logo": 1,
+                        "shows": {
+                            "$filter": {
+                                "input": "$shows",
+                                "as": "show",
+                                "cond": {
+                                    "$and": [
+                                        {"$lt": ["$$show.start_ts", end]},
+                                        {"$gt": ["$$show.end_ts", start]},
+                                    ]
+                                },
+                            }
+                        },
+                    }
+                },
+            ]
+        )
+    )
+
+
+def day_snapshot(start: int, category: str = constants.SNAPSHOT_ALL) -> list:
+    """Channels with their shows of a day, read from its snapshot."""
+    snapshot = Snapshot._get_collection().find_one(
+        {"timestamp": start, "category": category}
+    )
+    return snapshot["channels"] if snapshot else []
+
+
+def synthetic(channels: int, shows_per_channel: int) -> dict:
+    """Build raw mts channels and shows, shows listed day by day like the API pages.
+
+    Args:
+        channels (int): Number of channels
+        shows_per_channel (int): Number of hourly shows of every channel
+
+    Returns:
+        dict: Raw channels and shows
+    """
+    data = {"channels": [], "shows": []}
+    start = pendulum.datetime(2022, 3, 20, tz="Europe/Belgrade")
+
+    for oid in range(1, channels + 1):
+        data["channels"].append(
+            {"id": str(oid), "name": f"Channel { oid }", "image": "", "category": "Film"}
+        )
+
+    for hour in range(shows_per_channel):
+        show_start = start.add(hours=hour)
+        show_end = show_start.add(hours=1)
+
+        for oid in range(1, channels + 1):
+            data["shows"].append(
+                {
+                    "title": f"Show { hour }",
+                    "category": "Film",
+                    "description": "",
+                    "full_start": show_start.format("YYYY-MM-DD HH:mm:ss"),
+                    # Midnight is listed as 24:00 of the previous day
+                    "full_end": (
+                        f"{ show_start.to_date_string() } 24:00:00"
+                        if show_end.hour == 0
+                        else show_end.format("YYYY-MM-DD HH:mm:ss")
+                    ),
+                    "duration": "60",
+                    "image": "",
+                    "id_channel": str(oid),
+                }
+            )
+
+    return data
+
+
+def legacy_join(scraper: MTS, data: list, shows: list) -> list:
+    """Join shows to channels scanning all shows for every channel, as before grouping."""
+    return [
+        scraper.parser.parse_channel(item, [show for show in shows if show.oid == int(item["id"])])
+        for item in data
+    ]
+
+
+def compare_join(sizes: list[int]) -> None:
+    """Compare scanning and grouped show-to-channel joins as channel count grows.
+    Shows per channel stay fixed, so linear joins keep a flat time per show."""
+    scraper = MTS()
+
+    for channels in sizes:
+        data = synthetic(channels, 48)
+        shows = scraper.parse_shows(data["shows"])
+
+        for stage, join in (("join.scan", legacy_join), ("join.group", MTS.parse_channels)):
+            _, elapsed = timed(join, scraper, data["channels"], shows)
+            report_cost(stage, channels, len(shows), elapsed)
+
+
+def legacy_parse_datetime(datetime_str: str) -> tuple:
+    """Parse datetime through pendulum.parse, as before the fixed-format fast path."""
+    chars = list(datetime_str)
+
+    if chars[11] == "2" and chars[12] == "4":
+        chars[11], chars[12] = "0", "0"
+
+    parsed = pendulum.parse("".join(chars), tz="Europe/Belgrade")
+
+    return (parsed, int(parsed.timestamp()))
+
+
+def legacy_parse_times(items: list[dict]) -> int:
+    """Parse show times the way parse_show used to, every field twice."""
+    for item in items:
+        legacy_parse_datetime(item["full_start"])
+        legacy_parse_datetime(item["full_start"])
+        legacy_parse_datetime(item["full_end"])
+        legacy_parse_datetime(item["full_end"])
+
+    return len(items)
+
+
+def compare_datetime(sizes: list[int]) -> None:
+    """Compare per-show cost of parsing times through pendulum.parse against
+    whole shows parsed with the fast path, over a week spanning a DST switch."""
+    for channels in sizes:
+        items = synthetic(channels, 7 * 24)["shows"]
+        parser = ParserMTS()
+
+        for stage, parse in (
+            ("dt.parse", legacy_parse_times),
+            ("dt.fast", lambda items: [parser.parse_show(item) for item in items]),
+        ):
+            _, elapsed = timed(parse, items)
+            report_cost(stage, channels, len(items), elapsed)
+
+
+def legacy_insert(channels: list) -> None:
+    """Insert channels as mongoengine documents in a single call, as before batching."""
+    Channel.objects.insert(
+        [
+            Channel(**{**doc, "shows": [Show(**show) for show in doc["shows"]]})
+            for doc in (channel.to_mongo() for channel in channels)
+        ]
+    )
+
+
+def compare_insert(sizes: list[int]) -> None:
+    """Compare a single mongoengine insert against chunked unordered batches
+    of different sizes, written one by one and in parallel."""
+    scraper = MTS()
+    defaults = (Database._BATCH_SIZE, Database._WRITE_WORKERS)
+
+    for channels in sizes:
+        data = synthetic(channels, 3 * 24)
+        records = scraper.parse_channels(data["channels"], scraper.parse_shows(data["shows"]))
+
+        Database.drop(Channel)
+        _, elapsed, peak = measure(legacy_insert, records)
+        report("ins.single", channels, len(records), elapsed, peak)
+
+        try:
+            for batch_size, workers in ((25, 1), (100, 1), (25, 4)):
+                Database._BATCH_SIZE, Database._WRITE_WORKERS = batch_size, workers
+                Database.drop(Channel)
+                timings, elapsed, peak = measure(Database.insert_all, Channel, records)
+                report(f"ins.{ batch_size }x{ workers }", channels, len(records), elapsed, peak)
+                print(
+                    f"{ 'batches':<10} { channels:>4}x { len(timings):>9} batches "
+                    f"{ min(timings, default=0):>8.3f}s min { max(timings, default=0):>8.3f}s max"
+                )
+        finally:
+            Database._BATCH_SIZE, Database._WRITE_WORKERS = defaults
+
+
+def legacy_parse(parser: ParserMTS, data: dict) -> list:
+    """Parse channels and shows into mongoengine documents, as before slotted records."""
+    shows = helpers.group_by_oid(
+        [Show(**parser.parse_show(item).to_mongo()) for item in data["shows"]]
+    )
+    return [
+        Channel(**{**channel.to_mongo(), "shows": shows.get(channel.oid, [])})
+        for channel in (parser.parse_channel(item, []) for item in data["channels"])
+    ]
+
+
+def record_parse(parser: ParserMTS, data: dict) -> list:
+    """Parse channels and shows into slotted records."""
+    shows = helpers.group_by_oid([parser.parse_show(item) for item in data["shows"]])
+    return [parser.parse_channel(item, shows.get(int(item["id"]), [])) for item in data["channels"]]
+
+
+def compare_parse(sizes: list[int]) -> None:
+    """Compare time and peak memory of parsing a week of shows into mongoengine
+    documents against slotted records, parsed channels are kept alive at the peak."""
+    for channels in sizes:
+        data = synthetic(channels, 7 * 24)
+        shows = len(data["shows"])
+
+        for stage, parse in (("parse.doc", legacy_parse), ("parse.rec", record_parse)):
+            _, elapsed, peak = measure(parse, ParserMTS(), data)
+            report(stage, channels, shows, elapsed, peak)
+            print(
+                f"{ 'per show':<10} { channels:>4}x "
+                f"{ peak * 2**20 / max(shows, 1):>9.0f} B/show peak"
+            )
+
+
+def connect_db() -> None:
+    connect(
+        config("BENCHMARK_DB_NAME", default="etl_benchmark"),
+        host=config("BENCHMARK_DB_HOST", default="mongomock://localhost"),
+    )
+
+
+def main(scales: list[int]) -> None:
+    connect_db()
+
+    scrapers = [MTS(), SBB()]
+    raw = {scraper.provider: scraper.fetch_data() for scraper in scrapers}
+
+    for factor in scales:
+        channels = []
+
+        for scraper in scrapers:
+            if not raw[scraper.provider] or not raw[scraper.provider]["channels"]:
+                print(f"No fixtures replayed for { scraper.provider }")
+                continue
+
+            data = scale(scraper.provider, raw[scraper.provider], factor)
+
+            shows, elapsed, peak = measure(scraper.parse_shows, data["shows"])
+            report(f"parse.{ scraper.provider }", factor, len(shows), elapsed, peak)
+
+            parsed, elapsed, peak = measure(scraper.parse_channels, data["channels"], shows)
+            report(f"join.{ scraper.provider }", factor, len(shows), elapsed, peak)
+
+            channels.extend(parsed)
+
+        quality, elapsed, peak = measure(Validator.validate, channels)
+        report("validate", factor, sum(row["shows"] for row in quality), elapsed, peak)
+
+        Database.drop(Channel)
+        _, elapsed, peak = measure(Database.insert_all, Channel, channels)
+        report("load", factor, len(channels), elapsed, peak)
+
+        compare_exports(factor, channels)
+        compare_compaction(factor, channels)
+
+        shows = helpers.flatten_shows(channels)
+        Database.drop(ScheduledShow)
+        _, elapsed, peak = measure(Database.insert_all, ScheduledShow, shows)
+        report("flatten", factor, len(shows), elapsed, peak)
+
+        if not shows:
+            continue
+
+        # Middle of the scraped window
+        now = (min(s["start_ts"] for s in shows) + max(s["end_ts"] for s in shows)) // 2
+
+        found, elapsed, peak = measure(now_playing_embedded, now)
+        report("now.emb", factor, len(found), elapsed, peak)
+
+        found, elapsed, peak = measure(now_playing_flat, now)
+        report("now.flat", factor, len(found), elapsed, peak)
+
+        snapshots, elapsed, peak = measure(helpers.build_snapshots, channels)
+        report("snapshot", factor, len(snapshots), elapsed, peak)
+
+        Database.drop(Snapshot)
+        _, elapsed, peak = measure(Database.insert_all, Snapshot, snapshots)
+        report("snap.load", factor, len(snapshots), elapsed, peak)
+
+        # Day and most common category around now
+        day = max(s["timestamp"] for s in snapshots if s["timestamp"] <= now)
+        end = min((s["timestamp"] for s in snapshots if s["timestamp"] > day), default=day + 86400)
+        category = max(
+            (s for s in snapshots if s["timestamp"] == day and s["category"] != constants.SNAPSHOT_ALL),
+            key=lambda s: len(s["channels"]),
+            default={"category": constants.SNAPSHOT_ALL},
+        )["category"]
+
+        found, elapsed, peak = measure(day_embedded, day, end)
+        report("day.emb", factor, len(found), elapsed, peak)
+
+        found, elapsed, peak = measure(day_snapshot, day)
+        report("day.snap", factor, len(found), elapsed, peak)
+
+        found, elapsed, peak = measure(day_embedded, day, end, category)
+        report("cat.emb", factor, len(found), elapsed, peak)
+
+        found, elapsed, peak = measure(day_snapshot, day, category)
+        report("cat.snap", factor, len(found), elapsed, peak)
+
+
+# Micro-benchmarks on synthetic data, sized by channel count
+MICRO = {
+    "join": (compare_join, [50, 100, 200, 400]),
+    "datetime": (compare_datetime, [10, 50]),
+    "insert": (compare_insert, [25, 100]),
+    "parse": (compare_parse, [50, 300]),
+}
+
+if __name__ == "__main__":
+    if sys.argv[1:2] and sys.argv[1] in MICRO:
+        func, sizes = MICRO[sys.argv[1]]
+        connect_db()
+        func([int(arg) for arg in sys.argv[2:]] or sizes)
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100])
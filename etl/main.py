@@ -1,18 +1,432 @@
 import logging
+import signal
+import sys
+import threading
+import time
+from functools import partial
+from typing import Iterable
 
 import pendulum
+from decouple import config
 
-from orm.models import Channel, Date
-from scrapers.mts import MTS
-from scrapers.sbb import SBB
+from orm.models import Channel, Date, ScheduledShow, Snapshot
+from orm.records import ChannelRecord
+from scrapers import Provider
+from services.cache import ResponseCache
+from services.checkpoint import Checkpoint
 from services.db import Database
+from services.export import Export
+from services.pipeline import Pipeline
 from utils import helpers
 from utils.logger import Logger
+from utils.metrics import Metrics
 from utils.parsers import DateParser
+from utils.validator import Validator
+
+# Keep flattened show collection in sync with channels
+FLAT_SHOWS = config("FLAT_SHOWS", default=False, cast=bool)
+
+# Merge channels carried by more than one provider
+MERGE_CHANNELS = config("MERGE_CHANNELS", default=False, cast=bool)
+
+# Materialize per-day, per-category schedule snapshots
+SNAPSHOTS = config("SNAPSHOTS", default=False, cast=bool)
+
+
+def resumed(checkpoint: Checkpoint, step: str) -> bool:
+    """Check whether step was completed by an interrupted earlier attempt of the run."""
+    if checkpoint is not None and checkpoint.done(step):
+        logging.info(f"Skipping { step }, completed by an earlier attempt")
+        return True
+
+    return False
+
+
+def write_failed(name: str) -> bool:
+    """Report a failed write of a collection, the next run resumes it."""
+    print(f"Writing { name } failed, run again to resume")
+    logging.error(f"Writing { name } failed, checkpoint is kept to resume from")
+    return False
+
+
+def load_full(
+    channels: list[ChannelRecord], dates: list[Date], checkpoint: Checkpoint = None
+) -> bool:
+    """Replace stored channels and dates with freshly scraped ones.
+    A resumed run doesn't clear the database again and skips written batches.
+    Returns False if a write failed, leaving the checkpoint to resume from."""
+    # Clear the database
+    if not resumed(checkpoint, "drop"):
+        Database.drop(Channel)
+        Database.drop(Date)
+
+        if checkpoint is not None:
+            checkpoint.complete("drop")
+
+    print("Database cleared\nWriting to database...")
+
+    # Save data to database
+    if Database.insert_all(Channel, channels, checkpoint) is None:
+        return write_failed("channels")
+    print(f"{ len(channels) } channels saved to database")
+
+    if Database.insert_all(Date, dates, checkpoint) is None:
+        return write_failed("dates")
+    print(f"{ len(dates) } dates saved to database")
+
+    if FLAT_SHOWS:
+        shows = helpers.flatten_shows(channels)
+
+        if not resumed(checkpoint, "drop.flat"):
+            Database.drop(ScheduledShow)
+
+            if checkpoint is not None:
+                checkpoint.complete("drop.flat")
+
+        if Database.insert_all(ScheduledShow, shows, checkpoint) is None:
+            return write_failed("shows")
+        print(f"{ len(shows) } shows saved to database")
+
+    return True
+
+
+def load_swap(channels: list[ChannelRecord], dates: list[Date]) -> None:
+    """Swap freshly scraped channels and dates in place of stored ones."""
+    print("Writing to staging collections...")
+
+    Database.swap_all(Channel, channels)
+    print(f"{ len(channels) } channels swapped into database")
+
+    Database.swap_all(Date, dates)
+    print(f"{ len(dates) } dates swapped into database")
+
+    if FLAT_SHOWS:
+        shows = helpers.flatten_shows(channels)
+        Database.swap_all(ScheduledShow, shows)
+        print(f"{ len(shows) } shows swapped into database")
+
+
+def load_stream(scrapers: list) -> None:
+    """Stream scraped batches straight into the database."""
+    print("Streaming to database...")
+
+    pipeline = Pipeline(scrapers, *delta_window(scrapers), flat=FLAT_SHOWS)
+    bounds = pipeline.run()
+    print(f"{ pipeline.channels } channels with { pipeline.shows } shows streamed")
+
+    if bounds is None:
+        return
+
+    finalize(scrapers, pipeline.providers)
+
+    # Channels were never held in memory, snapshots are built from stored ones
+    load_snapshots(Database.channels())
+    Export.export_all(Database.channels)
+
+    parsed_dates = DateParser.parse_range(*bounds)
+    Database.swap_all(Date, parsed_dates)
+    print(f"{ len(parsed_dates) } dates swapped into database")
+
+
+def load_snapshots(channels: Iterable[ChannelRecord]) -> None:
+    """Rebuild day snapshots of channels and swap them in place of stored ones."""
+    if not SNAPSHOTS:
+        return
+
+    with Metrics.stage("snapshot"):
+        snapshots = helpers.build_snapshots(channels)
+
+    Database.swap_all(Snapshot, snapshots)
+    print(f"{ len(snapshots) } snapshots swapped into database")
+
+
+def delta_window(scrapers: list) -> tuple[dict, dict]:
+    """Look up finalized days and their stored shows for every provider."""
+    watermarks = {}
+    histories = {}
+
+    if not config("DELTA_FETCH", default=False, cast=bool):
+        return (watermarks, histories)
+
+    retention = (
+        pendulum.now("Europe/Belgrade")
+        .subtract(days=config("HISTORY_DAYS", default=7, cast=int))
+        .start_of("day")
+        .int_timestamp
+    )
+
+    for scraper in scrapers:
+        since = Database.get_watermark(scraper.provider)
+
+        if since is None:
+            continue
+
+        watermarks[scraper.provider] = since
+        histories[scraper.provider] = Database.history(
+            scraper.provider, retention, since
+        )
+        print(f"Fetching { scraper.provider } from { pendulum.from_timestamp(since) }")
+
+    return (watermarks, histories)
+
+
+def finalize(providers: list[Provider], loaded: set) -> None:
+    """Mark days before today as finalized for providers loaded in this run,
+    up to the earliest day whose page failed."""
+    if not config("DELTA_FETCH", default=False, cast=bool):
+        return
+
+    today = pendulum.now("Europe/Belgrade").start_of("day").int_timestamp
+
+    for provider in providers:
+        if provider.provider in loaded:
+            Database.set_watermark(provider.provider, provider.finalized_until(today))
+
+
+def scrape_all(providers: list[Provider], watermarks: dict) -> dict[str, list]:
+    """Scrape all providers concurrently, each within its own timeout."""
+    tasks = {
+        provider.provider: (
+            partial(provider.scrape_exclusive, watermarks.get(provider.provider)),
+            provider.timeout,
+        )
+        for provider in providers
+    }
+    results = helpers.run_isolated(tasks)
+
+    for name, channels in results.items():
+        if channels is None:
+            print(f"Scraping { name } failed, continuing without it")
+
+    return {name: channels for name, channels in results.items() if channels}
+
+
+def merge(channels: list[ChannelRecord]) -> list[ChannelRecord]:
+    """Merge channels carried by more than one provider."""
+    with Metrics.stage("merge", len(channels)):
+        channels, removed = helpers.merge_channels(channels)
+
+    print(f"{ removed['channels'] } duplicate channels and { removed['shows'] } duplicate shows removed")
+    logging.info(
+        f"Merge removed { removed['channels'] } duplicate channels "
+        f"and { removed['shows'] } duplicate shows"
+    )
+    return channels
+
+
+def rollback() -> None:
+    """Restore channels and dates saved by the last swap."""
+    Logger.initialize()
+    Database.initialize()
+
+    Database.rollback(Channel)
+    Database.rollback(Date)
+
+    if FLAT_SHOWS:
+        Database.rollback(ScheduledShow)
+
+    if SNAPSHOTS:
+        Database.rollback(Snapshot)
+    print("Channels and dates restored from previous version")
+
+
+def load_incremental(channels: list[ChannelRecord], dates: list[Date]) -> None:
+    """Write only the differences between scraped and stored data."""
+    print("Writing changes to database...")
+
+    # Only diff against providers present in this run,
+    # so a failed provider doesn't wipe out its stored channels
+    providers = list({channel.provider for channel in channels})
+    query = {"$or": [{"provider": {"$in": providers}}, {"provider": None}]}
+
+    counts = Database.upsert_all(
+        Channel, channels, key=("provider", "oid", "category"), query=query
+    )
+    print(
+        f"Channels: { counts['inserted'] } inserted, { counts['updated'] } updated, "
+        f"{ counts['deleted'] } deleted, { counts['unchanged'] } unchanged"
+    )
+    print(
+        f"Shows: { counts['shows_inserted'] } inserted, { counts['shows_updated'] } updated, "
+        f"{ counts['shows_deleted'] } deleted"
+    )
+
+    # Without shows there are no dates to sync, keep stored ones
+    if dates:
+        counts = Database.upsert_all(Date, dates, key=("timestamp",))
+        print(
+            f"Dates: { counts['inserted'] } inserted, { counts['updated'] } updated, "
+            f"{ counts['deleted'] } deleted"
+        )
+
+    if FLAT_SHOWS:
+        counts = Database.upsert_all(
+            ScheduledShow,
+            helpers.flatten_shows(channels),
+            key=("provider", "oid", "start_ts"),
+            query=query,
+        )
+        print(
+            f"Show collection: { counts['inserted'] } inserted, { counts['updated'] } updated, "
+            f"{ counts['deleted'] } deleted"
+        )
+
+
+def incremental_dates(channels: list[ChannelRecord]) -> list[Date]:
+    """Parse dates covering shows of scraped channels and stored shows of other providers,
+    which incremental loads keep."""
+    names = list({channel.provider for channel in channels})
+    bounds = [
+        b
+        for b in (
+            helpers.min_max_ts(channels),
+            Database.show_bounds({"provider": {"$nin": names}}),
+        )
+        if b
+    ]
+
+    if not bounds:
+        return []
+
+    return DateParser.parse_range(
+        min(start for start, _ in bounds), max(end for _, end in bounds)
+    )
+
+
+def load(
+    channels: list[ChannelRecord],
+    providers: list[Provider],
+    load_mode: str,
+    checkpoint: Checkpoint = None,
+) -> bool:
+    """Prepare dates for scraped channels and load both with given mode.
+    Returns False if a full load failed partway and has to be resumed."""
+    with Metrics.stage("dates"):
+        if load_mode == "incremental":
+            parsed_dates = incremental_dates(channels)
+        else:
+            bounds = helpers.min_max_ts(channels)
+            parsed_dates = DateParser.parse_range(*bounds) if bounds else []
+
+    if not resumed(checkpoint, "load"):
+        if load_mode == "incremental":
+            load_incremental(channels, parsed_dates)
+        elif load_mode == "swap":
+            load_swap(channels, parsed_dates)
+        elif not load_full(channels, parsed_dates, checkpoint):
+            return False
+
+        if checkpoint is not None:
+            checkpoint.complete("load")
+
+    # Incremental loads keep stored channels of providers missing from this run
+    if load_mode == "incremental":
+        load_snapshots(Database.channels())
+        Export.export_all(Database.channels)
+    else:
+        load_snapshots(channels)
+        Export.export_all(lambda: channels)
+    finalize(providers, {channel.provider for channel in channels})
+    return True
+
+
+def collect(results: dict[str, list], histories: dict) -> list[ChannelRecord]:
+    """Combine scraped channels of all providers with their stored history,
+    merge and validate them as configured."""
+    channels = []
+
+    for name, scraped in results.items():
+        # Merge with stored shows of finalized days
+        helpers.merge_history(scraped, histories.get(name, {}))
+        channels.extend(scraped)
+
+    if MERGE_CHANNELS:
+        channels = merge(channels)
+
+    if Validator.enabled():
+        Validator.validate(channels)
+
+    return channels
+
+
+def refresh(providers: list[Provider]) -> None:
+    """Scrape given providers and sync their channels, leaving other providers' intact."""
+    watermarks, histories = delta_window(providers)
+    channels = collect(scrape_all(providers, watermarks), histories)
+
+    if not channels:
+        logging.error("No channels scraped, database is left untouched")
+        return
+
+    with Metrics.stage("dates"):
+        parsed_dates = incremental_dates(channels)
+
+    load_incremental(channels, parsed_dates)
+    load_snapshots(Database.channels())
+    Export.export_all(Database.channels)
+    finalize(providers, {channel.provider for channel in channels})
+
+
+def daemon() -> None:
+    """Stay alive and refresh every provider once its interval is due.
+    Database client, HTTP pools, tokens and parser state are kept warm
+    between cycles. Changes are always synced incrementally."""
+    Logger.initialize()
+    Database.initialize()
+
+    cache = ResponseCache.from_config()
+    providers = Provider.create_all(cache)
+    due_at = {provider.provider: 0.0 for provider in providers}
+    stop = threading.Event()
+
+    # Finish the running cycle on termination
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    logging.info(f"Daemon started: { ', '.join(p.provider for p in providers) }")
+
+    while not stop.is_set():
+        now = time.monotonic()
+
+        # A scrape abandoned after its timeout may still be running
+        for provider in providers:
+            if due_at[provider.provider] <= now and provider.running:
+                logging.error(f"{ provider.provider } is still scraping, postponing its refresh")
+                due_at[provider.provider] = now + provider.interval
+
+        due = [provider for provider in providers if due_at[provider.provider] <= now]
+
+        if not due:
+            stop.wait(min(due_at.values()) - now)
+            continue
+
+        start = pendulum.now()
+        Metrics.reset()
+        logging.info(f"Refreshing { ', '.join(p.provider for p in due) }")
+
+        try:
+            refresh(due)
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+        # Intervals count from the start of a cycle, so refreshes don't drift
+        for provider in due:
+            due_at[provider.provider] = now + provider.interval
+
+        if cache is not None:
+            cache.log_stats()
+
+        Metrics.emit()
+        logging.info(
+            f"Refreshed { ', '.join(p.provider for p in due) } in "
+            f"{ pendulum.now().diff(start).in_seconds() } seconds"
+        )
+
+    logging.info("Daemon stopped")
 
 
 def main():
     start = pendulum.now()
+    Metrics.reset()
     print(f"Started at { start.to_datetime_string() }")
 
     # Initializers
@@ -23,46 +437,72 @@ def main():
     logging.info(f"Started at { start.to_datetime_string() }")
 
     # Instantiate scrapers
-    mts = MTS()
-    sbb = SBB()
+    cache = ResponseCache.from_config()
+    checkpoint = Checkpoint.from_config()
+    providers = Provider.create_all(cache, checkpoint)
     print("Scrapers initialized")
-    logging.info("Scrapers initialized")
+    logging.info(f"Scrapers initialized: { ', '.join(p.provider for p in providers) }")
     print("Working...")
-    # Scrape data
-    mts_channels = mts.scrape()
-    sbb_channels = sbb.scrape()
+    load_mode = config("LOAD_MODE", default="full")
 
-    print("Scraping completed...")
-    logging.info("Scraping completed...")
+    completed = True
 
-    # Concat datasets
-    channels = mts_channels + sbb_channels
+    if load_mode == "stream":
+        load_stream(providers)
+    else:
+        # A resumed run loads the very channels its written batches were cut from
+        channels = checkpoint.load_channels() if checkpoint is not None else None
 
-    # Prepare dates data
-    start_dt, end_dt = helpers.min_max_date(channels[:20])
-    dates = helpers.daterange(start_dt, end_dt)
-    parsed_dates = [DateParser.parse(date) for date in dates]
+        if channels is not None:
+            print(f"{ len(channels) } channels loaded from checkpoint")
+            logging.info(f"Resuming with { len(channels) } channels collected by an earlier attempt")
 
-    # Clear the database
-    Database.drop(Channel)
-    Database.drop(Date)
+            # Pages failed by the earlier attempt aren't known, so nothing is finalized
+            providers = []
+        else:
+            watermarks, histories = delta_window(providers)
 
-    print("Database cleared\nWriting to database...")
+            # Scrape data
+            results = scrape_all(providers, watermarks)
 
-    # Save data to database
-    Database.insert_all(Channel, channels)
-    print(f"{ len(channels) } channels saved to database")
+            print("Scraping completed...")
+            logging.info("Scraping completed...")
+
+            channels = collect(results, histories)
+
+            if channels and checkpoint is not None:
+                checkpoint.store_channels(channels)
+
+        if channels:
+            completed = load(channels, providers, load_mode, checkpoint)
+        else:
+            print("No channels scraped, database is left untouched")
+            logging.error("No channels scraped, database is left untouched")
 
-    Database.insert_all(Date, parsed_dates)
-    print(f"{ len(parsed_dates) } dates saved to database")
+    if cache is not None:
+        cache.log_stats()
+
+    # Run finished, the next one starts from scratch
+    if checkpoint is not None and completed:
+        checkpoint.clear()
+
+    Metrics.emit()
 
     end = pendulum.now()
     print(f"Finished at { end.now().to_datetime_string() }")
     print(f"Total time: { end.diff(start).in_seconds() } seconds")
+    print(f"Peak memory: { helpers.peak_rss_mb():.1f} MB")
 
     logging.info(
-        f"Finished at { end.now().to_datetime_string() } (Runtime: { end.diff(start).in_seconds() } seconds)"
+        f"Finished at { end.now().to_datetime_string() } (Runtime: { end.diff(start).in_seconds() } seconds, "
+        f"peak memory: { helpers.peak_rss_mb():.1f} MB)"
     )
 
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["rollback"]:
+        rollback()
+    elif sys.argv[1:] == ["daemon"]:
+        daemon()
+    else:
+        main()
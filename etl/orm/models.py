@@ -22,6 +22,9 @@ class Show(EmbeddedDocument):
     duration = FloatField()
     poster = StringField()
     oid = IntField()
+    # Set instead of full values when shows are stored compacted
+    poster_ref = IntField()
+    category_ref = IntField()
 
     def __str__(self):
         return f"{self.title} @ ({self.start_dt})"
@@ -30,15 +33,42 @@ class Show(EmbeddedDocument):
 class Channel(Document):
 
     oid = IntField()
+    provider = StringField()
     name = StringField(required=True)
     logo = StringField()
     category = ListField(field=StringField())
     shows = EmbeddedDocumentListField(Show)
 
+    meta = {"indexes": [("provider", "oid")]}
+
     def __str__(self):
         return f"{ self.name } / { ', '.join(self.category) } / ({ len(self.shows) }) shows"
 
 
+class ScheduledShow(Document):
+    """Flattened show, one document per show of a channel."""
+
+    title = StringField()
+    category = StringField()
+    description = StringField()
+    start_dt = DateTimeField()
+    end_dt = DateTimeField()
+    start_ts = IntField()
+    end_ts = IntField()
+    duration = FloatField()
+    poster = StringField()
+    oid = IntField()
+    provider = StringField()
+
+    meta = {
+        "collection": "show",
+        "indexes": [("oid", "start_ts"), ("start_ts", "end_ts")],
+    }
+
+    def __str__(self):
+        return f"{self.title} @ ({self.start_dt})"
+
+
 class Date(Document):
 
     date_tz = DateTimeField()
@@ -47,5 +77,60 @@ class Date(Document):
     month = StringField()
     day = IntField()
 
+    meta = {"indexes": ["timestamp"]}
+
     def __str__(self):
         return self.date_tz
+
+
+class SnapshotChannel(EmbeddedDocument):
+
+    oid = IntField()
+    provider = StringField()
+    name = StringField()
+    logo = StringField()
+    shows = EmbeddedDocumentListField(Show)
+
+    def __str__(self):
+        return f"{ self.name } / ({ len(self.shows) }) shows"
+
+
+class Snapshot(Document):
+    """Channels of a single category with their shows of a single day."""
+
+    timestamp = IntField(required=True)
+    category = StringField(required=True)
+    channels = EmbeddedDocumentListField(SnapshotChannel)
+
+    meta = {"indexes": [{"fields": ("timestamp", "category"), "unique": True}]}
+
+    def __str__(self):
+        return f"{ self.category } @ { self.timestamp } / ({ len(self.channels) }) channels"
+
+
+class Reference(Document):
+    """Value of a repeated show field, referenced from compacted shows."""
+
+    kind = StringField(required=True)
+    ref = IntField(required=True)
+    value = StringField()
+
+    meta = {
+        "indexes": [
+            {"fields": ("kind", "ref"), "unique": True},
+            {"fields": ("kind", "value"), "unique": True},
+        ]
+    }
+
+    def __str__(self):
+        return f"{ self.kind } #{ self.ref }: { self.value }"
+
+
+class Watermark(Document):
+
+    provider = StringField(required=True, unique=True)
+    finalized_ts = IntField()
+    updated_at = DateTimeField()
+
+    def __str__(self):
+        return f"{ self.provider } finalized until { self.finalized_ts }"
@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pendulum
+
+
+@dataclass(slots=True)
+class ShowRecord:
+    """Lightweight show used while scraping and parsing.
+    Mirrors :class:`etl.orm.models.Show` without mongoengine overhead."""
+
+    title: str
+    category: str
+    description: str
+    start_dt: datetime
+    end_dt: datetime
+    start_ts: int
+    end_ts: int
+    duration: float
+    poster: str
+    oid: int
+
+    def to_mongo(self) -> dict:
+        """Raw BSON-ready dict in the layout of :class:`etl.orm.models.Show`."""
+        return {
+            "title": self.title,
+            "category": self.category,
+            "description": self.description,
+            "start_dt": self.start_dt,
+            "end_dt": self.end_dt,
+            "start_ts": self.start_ts,
+            "end_ts": self.end_ts,
+            "duration": self.duration,
+            "poster": self.poster,
+            "oid": self.oid,
+        }
+
+    @classmethod
+    def from_mongo(cls, doc: dict) -> "ShowRecord":
+        """Build record from a stored show, restoring local datetimes."""
+        return cls(
+            title=doc.get("title"),
+            category=doc.get("category"),
+            description=doc.get("description"),
+            start_dt=pendulum.from_timestamp(doc["start_ts"], tz="Europe/Belgrade"),
+            end_dt=pendulum.from_timestamp(doc["end_ts"], tz="Europe/Belgrade"),
+            start_ts=doc["start_ts"],
+            end_ts=doc["end_ts"],
+            duration=doc.get("duration"),
+            poster=doc.get("poster"),
+            oid=doc.get("oid"),
+        )
+
+    def __str__(self):
+        return f"{self.title} @ ({self.start_dt})"
+
+
+@dataclass(slots=True)
+class ChannelRecord:
+    """Lightweight channel used while scraping and parsing.
+    Mirrors :class:`etl.orm.models.Channel` without mongoengine overhead."""
+
+    oid: int
+    provider: str
+    name: str
+    logo: str
+    category: list[str]
+    shows: list[ShowRecord] = field(default_factory=list)
+
+    def to_mongo(self) -> dict:
+        """Raw BSON-ready dict in the layout of :class:`etl.orm.models.Channel`."""
+        return {
+            "oid": self.oid,
+            "provider": self.provider,
+            "name": self.name,
+            "logo": self.logo,
+            "category": self.category,
+            "shows": [show.to_mongo() for show in self.shows],
+        }
+
+    @classmethod
+    def from_mongo(cls, doc: dict) -> "ChannelRecord":
+        """Build record from a stored channel and its expanded shows."""
+        return cls(
+            oid=doc.get("oid"),
+            provider=doc.get("provider"),
+            name=doc.get("name"),
+            logo=doc.get("logo"),
+            category=doc.get("category") or [],
+            shows=[ShowRecord.from_mongo(show) for show in doc.get("shows") or []],
+        )
+
+    def __str__(self):
+        return f"{ self.name } /{ ', '.join(self.category) } / ({ len(self.shows) }) shows"
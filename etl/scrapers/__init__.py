@@ -0,0 +1,3 @@
+# Importing provider modules registers them with Provider
+from scrapers import mts, sbb
+from scrapers.base import Provider
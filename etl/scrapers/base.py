@@ -0,0 +1,161 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator
+
+from decouple import Csv, config
+from orm.records import ChannelRecord, ShowRecord
+from services.cache import ResponseCache
+from services.checkpoint import Checkpoint
+
+
+class Provider(ABC):
+    """Base class of EPG providers.
+    Subclasses register themselves under their provider name,
+    so main can scrape every registered provider without knowing them.
+    A provider missing scrape or stream can't be instantiated."""
+
+    registry = {}
+    provider = None
+    checkpoint = None
+    # Start of the earliest day whose page failed in the last scrape
+    failed_since = None
+    # Whether a scrape is still running, possibly abandoned after its timeout
+    running = False
+    _running_lock = threading.Lock()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+
+        if cls.provider:
+            Provider.registry[cls.provider] = cls
+
+    @property
+    def timeout(self) -> int:
+        """Seconds a scrape of this provider may take before it is abandoned.
+
+        Returns:
+            int: Timeout in seconds
+        """
+        default = config("PROVIDER_TIMEOUT", default=900, cast=int)
+        return config(f"{ self.provider.upper() }_TIMEOUT", default=default, cast=int)
+
+    @property
+    def interval(self) -> int:
+        """Seconds between refreshes of this provider in daemon mode.
+
+        Returns:
+            int: Interval in seconds
+        """
+        default = config("REFRESH_INTERVAL", default=3600, cast=int)
+        return config(f"{ self.provider.upper() }_INTERVAL", default=default, cast=int)
+
+    def page(self, key: str, fetch: Callable) -> list:
+        """Fetch a raw page, going through the run checkpoint when there is one,
+        so pages fetched by an interrupted run aren't fetched again.
+
+        Args:
+            key (str): Page key, unique within the provider
+            fetch (Callable): Function fetching the page
+
+        Returns:
+            list: Page items
+        """
+        if self.checkpoint is None:
+            return fetch()
+
+        return self.checkpoint.page(f"{ self.provider }-{ key }", fetch)
+
+    def fail(self, day_ts: int) -> None:
+        """Remember a day whose page couldn't be fetched in this scrape.
+
+        Args:
+            day_ts (int): Unix timestamp of the start of the day
+        """
+        if self.failed_since is None or day_ts < self.failed_since:
+            self.failed_since = day_ts
+
+    def finalized_until(self, today: int) -> int:
+        """Get start of the first day that isn't finalized after the last scrape.
+        Days from the earliest failed one on aren't finalized, so they're fetched again.
+
+        Args:
+            today (int): Unix timestamp of the start of today
+
+        Returns:
+            int: Unix timestamp
+        """
+        if self.failed_since is None:
+            return today
+
+        return min(today, self.failed_since)
+
+    def scrape_exclusive(self, since: int = None) -> list[ChannelRecord]:
+        """Scrape unless the previous scrape of this provider is still running.
+        A scrape abandoned after its timeout keeps running on its thread, and
+        a second one would share its session, parser and failed days.
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Returns:
+            list[ChannelRecord]: List of channel records, None if already running
+        """
+        with Provider._running_lock:
+            if self.running:
+                logging.error(f"{ self.provider } is still scraping, skipping it")
+                return None
+
+            self.running = True
+
+        try:
+            return self.scrape(since)
+        finally:
+            self.running = False
+
+    @abstractmethod
+    def scrape(self, since: int = None) -> list[ChannelRecord]:
+        """Scrape data from API
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Returns:
+            list[ChannelRecord]: List of channel records with their respective shows
+        """
+
+    @abstractmethod
+    def stream(
+        self, since: int = None
+    ) -> Iterator[tuple[list[ChannelRecord], list[ShowRecord]]]:
+        """Scrape data from API batch by batch.
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Yields:
+            tuple(list[ChannelRecord], list[ShowRecord]): Next batch of channels and shows
+        """
+
+    @staticmethod
+    def create_all(
+        cache: ResponseCache = None, checkpoint: Checkpoint = None
+    ) -> list["Provider"]:
+        """Instantiate registered providers enabled by PROVIDERS setting.
+
+        Args:
+            cache (ResponseCache, optional): Response cache shared by providers
+            checkpoint (Checkpoint, optional): Checkpoint of the run raw pages are kept in
+
+        Returns:
+            list[Provider]: Provider instances
+        """
+        names = config("PROVIDERS", default=",".join(Provider.registry), cast=Csv())
+        providers = [
+            Provider.registry[name](cache) for name in names if name in Provider.registry
+        ]
+
+        for provider in providers:
+            provider.checkpoint = checkpoint
+
+        return providers
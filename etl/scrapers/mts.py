@@ -1,17 +1,52 @@
 import logging
-import requests
-from orm.models import Channel, Show
+from typing import Iterator
+
+import pendulum
+from decouple import config
+from orm.records import ChannelRecord, ShowRecord
+from scrapers.base import Provider
+from services import http
+from services.cache import ResponseCache
+from utils import constants, helpers
+from utils.metrics import Metrics
 from utils.parsers import ParserMTS
 
 
-class MTS:
-    def __init__(self):
+class MTS(Provider):
+
+    provider = "mts"
+
+    def __init__(self, cache: ResponseCache = None):
         self.base_url = "https://mts.rs/oec/epg"
         self.headers = {
             "Accept": "application/json",
             "X-Requested-With": "XMLHttpRequest",
         }
+        self.parse_workers = config("PARSE_WORKERS", default=1, cast=int)
         self.parser = ParserMTS()
+        self.max_workers = config("MTS_MAX_WORKERS", default=6, cast=int)
+        self.session = http.create_session(self.max_workers)
+        self.cache = cache
+
+    def get_json(self, path: str, endpoint: str, params: dict = None) -> dict | list:
+        """GET JSON from mts API through the response cache, if any.
+
+        Args:
+            path (str): Path relative to base URL
+            endpoint (str): Endpoint name used to look up cache TTL
+            params (dict, optional): Query params
+
+        Returns:
+            dict | list: Decoded JSON response
+        """
+        return http.get_json(
+            self.session,
+            self.base_url + path,
+            params=params,
+            headers=self.headers,
+            cache=self.cache,
+            ttl=constants.CACHE_TTL[endpoint],
+        )
 
     def fetch_categories(self) -> list[dict]:
         """Get all categories from mts API.
@@ -20,149 +55,284 @@ class MTS:
             list[dict]: List of categories as dicts
         """
         try:
-            response = requests.get(self.base_url + "/categories", headers=self.headers)
-            logging.info(f"{len(response.json())} categories fetched from mts API")
-            return response.json()
+            categories = self.page(
+                "categories", lambda: self.get_json("/categories", "categories")
+            )
+            logging.info(f"{len(categories)} categories fetched from mts API")
+            return categories
         except Exception as err:
             logging.error(err, exc_info=True)
             return None
 
-    def fetch_dates(self) -> list[dict]:
+    def is_pending(self, date: dict, since: int) -> bool:
+        """Check whether date isn't finalized yet and needs to be fetched.
+
+        Args:
+            date (dict): Date as dict
+            since (int): Unix timestamp of the first day that isn't finalized
+
+        Returns:
+            bool: True if date has to be fetched
+        """
+        day_ts = self.day_start(date)
+
+        # Fetch dates we can't reason about
+        return day_ts is None or day_ts >= since
+
+    def day_start(self, date: dict) -> int:
+        """Get start of date as unix timestamp, None if it can't be parsed.
+
+        Args:
+            date (dict): Date as dict
+
+        Returns:
+            int: Unix timestamp
+        """
+        try:
+            return pendulum.parse(date["value"], tz="Europe/Belgrade").start_of("day").int_timestamp
+        except Exception:
+            return None
+
+    def skip(self, date: dict, since: int = None) -> None:
+        """Skip shows of a date whose page failed, keeping the date from being finalized.
+
+        Args:
+            date (dict): Date as dict
+            since (int, optional): Start of the first day that isn't finalized
+        """
+        logging.error(f"Skipping shows for date { date['value'] }")
+        day_ts = self.day_start(date)
+        self.fail(day_ts if day_ts is not None else since or 0)
+
+    def fetch_dates(self, since: int = None) -> list[dict]:
         """Get all dates from mts API.
 
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
         Returns:
             list[dict]: List of dates as dicts
         """
         try:
-            response = requests.get(self.base_url + "/dates", headers=self.headers)
-            logging.info(f"{ len(response.json()) } dates fetched from mts API")
-            return response.json()
+            dates = self.page("dates", lambda: self.get_json("/dates", "dates"))
+
+            if since is not None:
+                dates = [date for date in dates if self.is_pending(date, since)]
+
+            logging.info(f"{ len(dates) } dates fetched from mts API")
+            return dates
         except Exception as err:
             logging.error(err, exc_info=True)
             return None
 
-    def fetch_channels(self) -> list[dict]:
-        """Fetch channels from mts API.
+    def fetch_category(self, category: dict) -> list[dict]:
+        """Fetch channels of a single category from mts API.
+
+        Args:
+            category (dict): Category as dict
 
         Returns:
             list[dict]: List of channels as dicts
         """
-        categories = self.fetch_categories()
-        channels = []
+        params = {
+            "category": category["id"],
+            "channel-type": "tv",
+        }
 
-        try:
-            for category in categories:
-                # Skip adult category
-                if category["text"] == "Za odrasle":
+        def fetch() -> list[dict]:
+            response = self.get_json("/program", "channels", params)
+            channels = []
+
+            for item in response.get("channels", []):
+                # skip mts promo channel
+                if item["name"] == "iris TV promo":
                     continue
 
-                params = {
-                    "category": category["id"],
-                    "channel-type": "tv",
-                }
-                response = requests.get(
-                    self.base_url + "/program", params=params, headers=self.headers
+                channels.append(
+                    {
+                        "id": item["id"],
+                        "name": item["name"],
+                        "image": item["image"],
+                        "category": category["text"],
+                    }
                 )
 
-                for item in response.json().get("channels", []):
-                    # skip mts promo channel
-                    if item["name"] == "iris TV promo":
-                        continue
-
-                    channels.append(
-                        {
-                            "id": item["id"],
-                            "name": item["name"],
-                            "image": item["image"],
-                            "category": category["text"],
-                        }
-                    )
-        except Exception as err:
-            logging.error(err, exc_info=True)
+            return channels
+
+        return self.page(f"category-{ category['id'] }", fetch)
+
+    def fetch_channels(self) -> list[dict]:
+        """Fetch channels from mts API.
+        Categories are fetched concurrently, failed ones are skipped.
+
+        Returns:
+            list[dict]: List of channels as dicts
+        """
+        categories = self.fetch_categories()
+
+        if categories is None:
             return None
 
+        # Skip adult category
+        categories = [c for c in categories if c["text"] != "Za odrasle"]
+        results = helpers.map_concurrent(
+            self.fetch_category, categories, self.max_workers
+        )
+        channels = []
+
+        for category, result in zip(categories, results):
+            if result is None:
+                logging.error(f"Skipping channels of category { category['text'] }")
+                continue
+            channels.extend(result)
+
         logging.info(f"Fetched { len(channels) } channels from mts API")
         return channels
 
-    def fetch_data(self) -> dict[list]:
-        """Fetch channels & shows data from API
+    def fetch_date(self, date: dict) -> list[dict]:
+        """Fetch shows of all channels for a single date from mts API.
+
+        Args:
+            date (dict): Date as dict
 
         Returns:
-            dict[list]: Dict with channels and shows data
+            list[dict]: List of shows as dicts
         """
-        channels = self.fetch_channels()
-        dates = self.fetch_dates()
+        params = {
+            "channel-type": "tv",
+            "date": date["value"],
+        }
 
-        shows = []
+        def fetch() -> list[dict]:
+            response = self.get_json("/program", "program", params)
+            shows = []
 
-        try:
-            # Fetch shows for each channel for all dates
-            for date in dates:
-                params = {
-                    "channel-type": "tv",
-                    "date": date["value"],
-                }
-                response = requests.get(
-                    self.base_url + "/program", params=params, headers=self.headers
-                )
+            for item in response.get("channels", []):
+                shows.extend(item["items"])
 
-                for item in response.json().get("channels", []):
-                    shows.extend(item["items"])
+            return shows
 
-        except Exception as err:
-            logging.error(err, exc_info=True)
+        return self.page(f"date-{ date['value'] }", fetch)
+
+    def fetch_data(self, since: int = None) -> dict[list]:
+        """Fetch channels & shows data from API.
+        Dates are fetched concurrently, failed ones are skipped.
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Returns:
+            dict[list]: Dict with channels and shows data
+        """
+        self.failed_since = None
+        channels = self.fetch_channels()
+        dates = self.fetch_dates(since)
+
+        if channels is None or dates is None:
             return None
 
+        results = helpers.map_concurrent(self.fetch_date, dates, self.max_workers)
+        shows = []
+
+        # Results are in the same order as dates
+        for date, result in zip(dates, results):
+            if result is None:
+                self.skip(date, since)
+                continue
+            shows.extend(result)
+
         logging.info(
             f"{ len(channels) } channels with total { len(shows) } shows fetched from MTS API"
         )
         return {"channels": channels, "shows": shows}
 
-    def parse_shows(self, data: list[dict]) -> list[Show]:
-        """Parse shows data and return list of Show objects
+    def parse_shows(self, data: list[dict]) -> list[ShowRecord]:
+        """Parse shows data and return list of show records.
+        Large inputs are parsed on a process pool if PARSE_WORKERS > 1.
 
         Args:
             data (list[dict]): List of shows data as dicts
 
         Returns:
-            list[Show]: List of Show objects
+            list[ShowRecord]: List of show records
         """
-        parsed = []
-
-        for item in data:
-            parsed.append(self.parser.parse_show(item))
+        with Metrics.stage("parse", len(data)):
+            return helpers.map_processes(
+                self.parser.parse_show, data, self.parse_workers
+            )
 
-        return parsed
-
-    def parse_channels(self, data: list[dict], shows: list[Show]) -> list[Channel]:
-        """Parse channels data and return list of Channel objects
+    def parse_channels(self, data: list[dict], shows: list[ShowRecord]) -> list[ChannelRecord]:
+        """Parse channels data and return list of channel records
 
         Args:
             data (list[dicts]): List of channels data as dicts
-            shows (list[Show]): List of Show objects
+            shows (list[ShowRecord]): List of show records
 
         Returns:
-            list[Channel]: List of Channel objects
+            list[ChannelRecord]: List of channel records
         """
         parsed = []
 
-        for item in data:
-            matching_shows = [show for show in shows if show.oid == int(item["id"])]
-            parsed.append(self.parser.parse_channel(item, matching_shows))
+        with Metrics.stage("join", len(shows)):
+            shows_by_oid = helpers.group_by_oid(shows)
+
+            for item in data:
+                matching_shows = shows_by_oid.get(int(item["id"]), [])
+                parsed.append(self.parser.parse_channel(item, matching_shows))
 
         logging.info(
             f"{ len(parsed) } channels parsed from mts API with total of { len(shows) } shows"
         )
         return parsed
 
-    def scrape(self) -> list[Channel]:
+    def scrape(self, since: int = None) -> list[ChannelRecord]:
         """Scrape data from API
 
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
         Returns:
-            list[Channel]: List of Channel objects with their respective shows
+            list[ChannelRecord]: List of channel records with their respective shows,
+                None if channels or dates couldn't be fetched
         """
 
-        data = self.fetch_data()
+        with Metrics.stage("fetch"):
+            data = self.fetch_data(since)
+
+        if data is None:
+            logging.error("Channels or dates couldn't be fetched from mts API")
+            return None
+
         shows = self.parse_shows(data["shows"])
         channels = self.parse_channels(data["channels"], shows)
         return channels
+
+    def stream(
+        self, since: int = None
+    ) -> Iterator[tuple[list[ChannelRecord], list[ShowRecord]]]:
+        """Scrape data from API batch by batch.
+        Channels are yielded first without shows, then shows are
+        yielded date by date as their pages arrive.
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Yields:
+            tuple(list[ChannelRecord], list[ShowRecord]): Next batch of channels and shows
+        """
+        self.failed_since = None
+        channels = self.fetch_channels()
+        dates = self.fetch_dates(since)
+
+        if channels is None or dates is None:
+            return
+
+        yield (self.parse_channels(channels, []), [])
+
+        pages = helpers.imap_concurrent(self.fetch_date, dates, self.max_workers)
+
+        for date, page in zip(dates, pages):
+            if page is None:
+                self.skip(date, since)
+                continue
+            yield ([], self.parse_shows(page))
@@ -1,14 +1,25 @@
 import logging
+import threading
+import time
+from functools import partial
+from typing import Iterator
 
 import pendulum
-import requests
 from decouple import config
-from orm.models import Channel, Show
+from orm.records import ChannelRecord, ShowRecord
+from scrapers.base import Provider
+from services import http
+from services.cache import ResponseCache
+from utils import constants, helpers
+from utils.metrics import Metrics
 from utils.parsers import ParserSBB
 
 
-class SBB:
-    def __init__(self) -> None:
+class SBB(Provider):
+
+    provider = "sbb"
+
+    def __init__(self, cache: ResponseCache = None) -> None:
         self.base_url = "https://api-web.ug-be.cdn.united.cloud"
         self.identifiers = [
             ("sk_rs", "404"),
@@ -18,11 +29,30 @@ class SBB:
             ("n1_hr", "181"),
             ("nova_rs", "404"),
         ]
-        self._bearer = self.get_bearer_token()
+        self.max_workers = config("SBB_MAX_WORKERS", default=3, cast=int)
+        self.session = http.create_session(self.max_workers)
+        self.cache = cache
+        self._bearer = None
+        self._bearer_expires = 0
+        self._bearer_lock = threading.Lock()
+        self.parse_workers = config("PARSE_WORKERS", default=1, cast=int)
         self.parser = ParserSBB()
 
+    @property
+    def bearer(self) -> str:
+        """Bearer token, fetched on first use and shared by all workers.
+        Token is fetched again once it's about to expire.
+
+        Returns:
+            str: Bearer token
+        """
+        with self._bearer_lock:
+            if not self._bearer or time.monotonic() >= self._bearer_expires:
+                self._bearer = self.get_bearer_token()
+            return self._bearer
+
     def get_bearer_token(self):
-        """Fetch Bearer token from SK API
+        """Fetch Bearer token from SK API and note when it expires
 
         Returns:
             str: Bearer token
@@ -30,54 +60,72 @@ class SBB:
 
         headers = {
             "Accept": "application/json",
-            "Authorization": "Basic " + config("SBB_BASIC_TOKEN"),
+            "Authorization": "Basic " + config("SBB_BASIC_TOKEN", default=""),
         }
         params = {"grant_type": "client_credentials"}
 
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.base_url + "/oauth/token", params=params, headers=headers
             )
+            token = response.json()
             logging.info(f"Bearer token successfully fetched from SBB API")
 
-            return response.json()["access_token"]
+            # Refresh a minute early, so no request goes out with a stale token
+            expires_in = int(token.get("expires_in") or 3600)
+            self._bearer_expires = time.monotonic() + max(expires_in - 60, 0)
+            return token["access_token"]
 
         except Exception as err:
             logging.error(err, exc_info=True)
 
-    def fetch_epg(self, channels: list[int], community: str, lang: str) -> list[dict]:
+    def fetch_epg(
+        self, channels: list[int], community: str, lang: str, since: int = None
+    ) -> list[dict]:
         """Fetch shows from API for given channel ids, community and language
 
         Args:
             channels (list[int]): List of channel ids
             community (str): Community identifier
             lang (str): Language identifier
+            since (int, optional): Skip days finalized before this unix timestamp
 
         Returns:
-            list[dict]: List of shows data as dicts
+            list[dict]: List of shows data as dicts, None if they couldn't be fetched
         """
-        if not self._bearer:
+        bearer = self.bearer
+
+        if not bearer:
             logging.error("Bearer token not found")
 
         headers = {
             "Accept": "application/json",
-            "Authorization": f"Bearer { self._bearer }",
+            "Authorization": f"Bearer { bearer }",
             "X-UCP-TIME-FORMAT": "timestamp",
         }
+        from_time = int(pendulum.now().add(days=-7).start_of("day").timestamp())
+
+        if since is not None:
+            from_time = max(from_time, since)
+
         params = {
             "cid": ",".join([str(id) for id in channels]),
-            "fromTime": int(pendulum.now().add(days=-7).start_of("day").timestamp()),
+            "fromTime": from_time,
             "toTime": int(pendulum.now().add(days=5).end_of("day").timestamp()),
             "communityIdentifier": community,
             "languageId": lang,
         }
 
         try:
-            response = requests.get(
-                self.base_url + "/v1/public/events/epg", params=params, headers=headers
-            )
             # Response is dictionary of channel ids as keys and list of shows as values
-            response = response.json()
+            response = http.get_json(
+                self.session,
+                self.base_url + "/v1/public/events/epg",
+                params=params,
+                headers=headers,
+                cache=self.cache,
+                ttl=constants.CACHE_TTL["epg"],
+            )
             shows = []
 
             for _, s in response.items():
@@ -86,99 +134,174 @@ class SBB:
             return shows
         except Exception as err:
             logging.error(err, exc_info=True)
-            return []
+            return None
 
-    def fetch_data(self) -> dict[list]:
-        """Fetch channels and shows data from API
+    def fetch_identifier(
+        self, identifier: tuple[str, str], since: int = None
+    ) -> dict[list]:
+        """Fetch channels and shows for a single community and language
+
+        Args:
+            identifier (tuple[str, str]): Community and language identifiers
+            since (int, optional): Skip days finalized before this unix timestamp
 
         Returns:
             dict[list]: Dictionary with channel and show lists
         """
+        community, lang = identifier
+        params = {
+            "imageSize": "S",
+            "communityIdentifier": community,
+            "languageId": lang,
+        }
 
-        if not self._bearer:
-            logging.error("Bearer token not found")
+        def fetch() -> list[dict]:
+            headers = {
+                "Accept": "application/json",
+                "Authorization": f"Bearer { self.bearer }",
+            }
+            channels = http.get_json(
+                self.session,
+                self.base_url + "/v2/public/channels",
+                params=params,
+                headers=headers,
+                cache=self.cache,
+                ttl=constants.CACHE_TTL["channels"],
+            )
 
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Bearer { self._bearer }",
-        }
+            # Fetch shows for these channels
+            ids = [channel["id"] for channel in channels]
+            shows = self.fetch_epg(ids, community, lang, since)
 
-        channels = []
-        shows = []
+            # Failed pages are left out of the checkpoint, so they're fetched again
+            if shows is None:
+                raise RuntimeError(f"Shows of { community } couldn't be fetched")
 
-        for identifier in self.identifiers:
-            params = {
-                "imageSize": "S",
-                "communityIdentifier": identifier[0],
-                "languageId": identifier[1],
-            }
+            return [{"channels": channels, "shows": shows}]
 
-            try:
-                response = requests.get(
-                    self.base_url + "/v2/public/channels",
-                    params=params,
-                    headers=headers,
-                )
+        return self.page(f"{ community }-{ lang }", fetch)[0]
 
-                channels.extend(response.json())
+    def fetch_data(self, since: int = None) -> dict[list]:
+        """Fetch channels and shows data from API.
+        Community/language pairs are fetched concurrently over a shared session.
 
-                # Fetch shows for these channels
-                ids = [channel["id"] for channel in response.json()]
-                shows.extend(self.fetch_epg(ids, identifier[0], identifier[1]))
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
 
-            except Exception as err:
-                logging.error(err, exc_info=True)
+        Returns:
+            dict[list]: Dictionary with channel and show lists
+        """
+
+        self.failed_since = None
+
+        # Token is fetched once up front, workers reuse it
+        if not self.bearer:
+            logging.error("Bearer token not found")
+
+        results = helpers.map_concurrent(
+            partial(self.fetch_identifier, since=since),
+            self.identifiers,
+            self.max_workers,
+        )
+        channels = []
+        shows = []
+
+        for result in results:
+            # Days of a failed community are fetched again on the next run
+            if result is None:
+                self.fail(since or 0)
+                continue
+            channels.extend(result["channels"])
+            shows.extend(result["shows"])
 
         logging.info(
             f"{ len(channels) } channels with total { len(shows) } shows fetched from SBB API"
         )
         return {"channels": channels, "shows": shows}
 
-    def parse_shows(self, data: list[dict]) -> list[Show]:
-        """Parse shows data and return list of Show objects
+    def parse_shows(self, data: list[dict]) -> list[ShowRecord]:
+        """Parse shows data and return list of show records.
+        Large inputs are parsed on a process pool if PARSE_WORKERS > 1.
 
         Args:
             data (list[dict]): List of shows data as dicts
 
         Returns:
-            list[Show]: List of Show objects
+            list[ShowRecord]: List of show records
         """
-        parsed = []
-
-        for item in data:
-            parsed.append(self.parser.parse_show(item))
-
-        return parsed
+        with Metrics.stage("parse", len(data)):
+            return helpers.map_processes(
+                self.parser.parse_show, data, self.parse_workers
+            )
 
-    def parse_channels(self, data: list[dict], shows: list[Show]) -> list[Channel]:
-        """Parse channels data and return list of Channel objects
+    def parse_channels(self, data: list[dict], shows: list[ShowRecord]) -> list[ChannelRecord]:
+        """Parse channels data and return list of channel records
 
         Args:
             data (list[dicts]): List of channels data as dicts
-            shows (list[Show]): List of Show objects
+            shows (list[ShowRecord]): List of show records
 
         Returns:
-            list[Channel]: List of Channel objects
+            list[ChannelRecord]: List of channel records
         """
         parsed = []
 
-        for item in data:
-            matching_shows = [show for show in shows if show.oid == item["id"]]
-            parsed.append(self.parser.parse_channel(item, matching_shows))
+        with Metrics.stage("join", len(shows)):
+            shows_by_oid = helpers.group_by_oid(shows)
+
+            for item in data:
+                matching_shows = shows_by_oid.get(item["id"], [])
+                parsed.append(self.parser.parse_channel(item, matching_shows))
 
         logging.info(
             f"{ len(parsed) } channels successfully parsed from SBB API with total of { len(shows) } shows"
         )
         return parsed
 
-    def scrape(self) -> list[Channel]:
+    def scrape(self, since: int = None) -> list[ChannelRecord]:
         """Scrape data from API
 
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
         Returns:
-            list[Channel]: List of Channel objects with their respective shows
+            list[ChannelRecord]: List of channel records with their respective shows
         """
 
-        data = self.fetch_data()
+        with Metrics.stage("fetch"):
+            data = self.fetch_data(since)
+
         shows = self.parse_shows(data["shows"])
         channels = self.parse_channels(data["channels"], shows)
         return channels
+
+    def stream(
+        self, since: int = None
+    ) -> Iterator[tuple[list[ChannelRecord], list[ShowRecord]]]:
+        """Scrape data from API batch by batch.
+        Channels of each community are yielded together with their shows.
+
+        Args:
+            since (int, optional): Skip days finalized before this unix timestamp
+
+        Yields:
+            tuple(list[ChannelRecord], list[ShowRecord]): Next batch of channels and shows
+        """
+        self.failed_since = None
+
+        if not self.bearer:
+            logging.error("Bearer token not found")
+
+        results = helpers.imap_concurrent(
+            partial(self.fetch_identifier, since=since),
+            self.identifiers,
+            self.max_workers,
+        )
+
+        for result in results:
+            if result is None:
+                self.fail(since or 0)
+                continue
+
+            shows = self.parse_shows(result["shows"])
+            yield (self.parse_channels(result["channels"], shows), [])
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from decouple import config
+
+
+class ResponseCache:
+    """Size-bounded on-disk cache of JSON API responses.
+    Entries are keyed by URL and params, stay fresh for a per-endpoint TTL
+    and are revalidated with ETag / Last-Modified once they expire."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Running total of entry sizes, corrected by every eviction scan
+        self._bytes = sum(size for _, size, _ in self.entries())
+
+    @staticmethod
+    def from_config() -> "ResponseCache":
+        """Create cache from environment, None if caching is disabled.
+
+        Returns:
+            ResponseCache: Configured cache or None
+        """
+        directory = config("HTTP_CACHE_DIR", default="")
+
+        if not directory:
+            return None
+
+        max_mb = config("HTTP_CACHE_MAX_MB", default=256, cast=int)
+        return ResponseCache(directory, max_mb * 2**20)
+
+    def path(self, url: str, params: dict = None) -> str:
+        """Get file path of the entry for given URL and params."""
+        key = json.dumps([url, sorted((params or {}).items())], default=str)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, f"{ digest }.json")
+
+    def load(self, path: str) -> dict:
+        """Read cache entry from disk, None if missing or unreadable."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, path: str, entry: dict) -> None:
+        """Atomically write cache entry to disk, evicting old entries once
+        the cache outgrows max size."""
+        tmp_path = f"{ path }.{ threading.get_ident() }.tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+
+        size = os.path.getsize(tmp_path)
+
+        try:
+            size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._bytes += size
+            full = self._bytes > self.max_bytes
+
+        if full:
+            self.evict()
+
+    def entries(self) -> list[tuple]:
+        """Get modification time, size and path of every cache entry."""
+        entries = []
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def evict(self) -> None:
+        """Remove least recently used entries until cache fits max size."""
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+            self._bytes = total
+
+    def get_json(
+        self,
+        session: requests.Session,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        ttl: int = 0,
+    ) -> dict | list:
+        """GET JSON response, served from cache while fresh.
+
+        Args:
+            session (requests.Session): Session to send requests with
+            url (str): URL to fetch
+            params (dict, optional): Query params
+            headers (dict, optional): Request headers
+            ttl (int, optional): Seconds a cached response stays fresh
+
+        Returns:
+            dict | list: Decoded JSON response
+        """
+        path = self.path(url, params)
+        entry = self.load(path)
+
+        if entry and time.time() - entry["stored_at"] < ttl:
+            with self._lock:
+                self.hits += 1
+
+            # Touch entry so eviction drops least recently used first
+            os.utime(path)
+            return entry["body"]
+
+        headers = dict(headers or {})
+
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = session.get(url, params=params, headers=headers)
+
+        if entry and response.status_code == 304:
+            with self._lock:
+                self.revalidated += 1
+
+            entry["stored_at"] = time.time()
+            self.store(path, entry)
+            return entry["body"]
+
+        with self._lock:
+            self.misses += 1
+
+        response.raise_for_status()
+        body = response.json()
+
+        if response.status_code == 200:
+            entry = {
+                "stored_at": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "body": body,
+            }
+            self.store(path, entry)
+
+        return body
+
+    def log_stats(self) -> None:
+        """Log hit, revalidation and miss counters."""
+        logging.info(
+            f"HTTP cache: { self.hits } hits, { self.revalidated } revalidated, "
+            f"{ self.misses } misses"
+        )
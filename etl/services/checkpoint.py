@@ -0,0 +1,187 @@
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable
+
+from decouple import config
+from orm.records import ChannelRecord
+
+
+class Checkpoint:
+    """Durable progress of a run on local disk.
+    Raw fetched pages are kept as gzip compressed JSONL files and completed
+    stages and batches are appended to a log, so a run that dies halfway
+    is resumed by the next one instead of starting over. Checkpoints are
+    cleared once a run finishes and ignored once they're older than max age."""
+
+    def __init__(self, directory: str, max_age: int) -> None:
+        self.directory = directory
+        self.max_age = max_age
+        self.log_path = os.path.join(directory, "completed.log")
+        self.started_path = os.path.join(directory, "started")
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        started_at = self.started_at()
+
+        if started_at is not None and time.time() - started_at > max_age:
+            logging.info("Checkpoint is too old, starting over")
+            self.clear()
+        elif started_at is None:
+            self.start()
+
+        self.completed = self.read_log()
+
+        if self.completed:
+            logging.info(f"Resuming run with { len(self.completed) } completed steps")
+
+    @staticmethod
+    def from_config() -> "Checkpoint":
+        """Create checkpoint from environment, None if checkpointing is disabled.
+
+        Returns:
+            Checkpoint: Configured checkpoint or None
+        """
+        directory = config("CHECKPOINT_DIR", default="")
+
+        if not directory:
+            return None
+
+        return Checkpoint(directory, config("CHECKPOINT_MAX_AGE", default=6 * 60 * 60, cast=int))
+
+    def start(self) -> None:
+        """Mark the start of a new run."""
+        with open(self.started_path, "w", encoding="utf-8") as file:
+            file.write(f"{ time.time() }\n")
+
+    def started_at(self) -> float:
+        """Get time the checkpointed run started at, None if there is none."""
+        try:
+            return os.path.getmtime(self.started_path)
+        except FileNotFoundError:
+            return None
+
+    def read_log(self) -> set:
+        """Read names of completed steps, skipping a partially written last line."""
+        try:
+            with open(self.log_path, encoding="utf-8") as file:
+                return {line[:-1] for line in file if line.endswith("\n")}
+        except FileNotFoundError:
+            return set()
+
+    def path(self, key: str) -> str:
+        """Get file path of the page stored under key."""
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "-", key)
+        return os.path.join(self.directory, f"{ slug }.jsonl.gz")
+
+    def load(self, key: str) -> list:
+        """Read page stored under key, None if it isn't stored or is unreadable.
+
+        Args:
+            key (str): Page key
+
+        Returns:
+            list: Stored items
+        """
+        try:
+            with gzip.open(self.path(key), "rt", encoding="utf-8") as file:
+                return [json.loads(line) for line in file]
+        except (OSError, EOFError, ValueError):
+            return None
+
+    def store(self, key: str, items: list) -> None:
+        """Atomically write page items as gzip compressed JSONL.
+
+        Args:
+            key (str): Page key
+            items (list): JSON serializable items
+        """
+        path = self.path(key)
+        tmp_path = f"{ path }.{ threading.get_ident() }.tmp"
+
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            for item in items:
+                file.write(json.dumps(item))
+                file.write("\n")
+
+        os.replace(tmp_path, path)
+
+    def page(self, key: str, fetch: Callable) -> list:
+        """Get page stored under key or fetch and store it.
+
+        Args:
+            key (str): Page key
+            fetch (Callable): Function fetching the page items
+
+        Returns:
+            list: Page items
+        """
+        items = self.load(key)
+
+        if items is None:
+            items = fetch()
+            self.store(key, items)
+
+        return items
+
+    def store_channels(self, channels: list[ChannelRecord]) -> None:
+        """Durably keep the final collected channels of the run, so a resumed
+        run loads exactly the same channels and batches instead of scraping again.
+
+        Args:
+            channels (list[ChannelRecord]): Collected channels with their shows
+        """
+        self.store(
+            "collected",
+            (
+                {
+                    **channel.to_mongo(),
+                    # Local datetimes are restored from timestamps on load
+                    "shows": [
+                        {k: v for k, v in show.to_mongo().items() if k not in ("start_dt", "end_dt")}
+                        for show in channel.shows
+                    ],
+                }
+                for channel in channels
+            ),
+        )
+        self.complete("collected")
+
+    def load_channels(self) -> list[ChannelRecord]:
+        """Get channels collected by an earlier attempt of the run, None if there are none."""
+        if not self.done("collected"):
+            return None
+
+        docs = self.load("collected")
+
+        return None if docs is None else [ChannelRecord.from_mongo(doc) for doc in docs]
+
+    def done(self, step: str) -> bool:
+        """Check whether step was completed by an earlier attempt of the run."""
+        return step in self.completed
+
+    def complete(self, step: str) -> None:
+        """Durably mark step as completed.
+
+        Args:
+            step (str): Step name
+        """
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(f"{ step }\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+            self.completed.add(step)
+
+    def clear(self) -> None:
+        """Remove all checkpointed pages and steps."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self.start()
+        self.completed = set()
@@ -1,7 +1,20 @@
 import logging
+import threading
+import time
+from typing import Iterator
 
+import bson
+import pendulum
 from decouple import config
 from mongoengine import connect
+from orm.models import Channel, Watermark
+from orm.records import ChannelRecord, ShowRecord
+from pymongo import DeleteOne, InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+from services.checkpoint import Checkpoint
+from services.lookup import Lookup
+from utils import helpers
+from utils.metrics import Metrics
 
 
 class Database:
@@ -10,6 +23,9 @@ class Database:
     _DB = config("DB_NAME", cast=str)
     _USER = config("DB_USER", cast=str)
     _SECRET = config("DB_PSWD", cast=str)
+    _BATCH_SIZE = config("DB_BATCH_SIZE", default=25, cast=int)
+    _WRITE_WORKERS = config("DB_WRITE_WORKERS", default=1, cast=int)
+    _WRITE_RETRIES = config("DB_WRITE_RETRIES", default=2, cast=int)
 
     @staticmethod
     def initialize() -> None:
@@ -24,21 +40,231 @@ class Database:
             logging.error(err, exc_info=True)
 
     @staticmethod
-    def insert_all(collection, data) -> None:
+    def _to_mongo(document) -> dict:
+        """Get raw BSON-ready dict of a document, record or plain dict.
+        Embedded shows of channels are compacted if COMPACT_SHOWS is enabled."""
+        doc = document if isinstance(document, dict) else document.to_mongo()
+
+        if Lookup.enabled() and isinstance(doc.get("shows"), list):
+            doc = {**doc, "shows": [Lookup.compact(show) for show in doc["shows"]]}
+
+        return doc
+
+    @staticmethod
+    def _write_batch(target, batch: list) -> float:
+        """Insert a batch of documents, retrying it on failure.
+
+        Args:
+            target (pymongo.collection.Collection): Collection to write into.
+            batch (list): Documents to insert.
+
+        Returns:
+            float: Time spent writing the batch in seconds.
+        """
+        # _id is assigned on first attempt, so retries can't duplicate documents
+        docs = [Database._to_mongo(doc) for doc in batch]
+        start = time.perf_counter()
+
+        for attempt in range(Database._WRITE_RETRIES + 1):
+            try:
+                target.insert_many(docs, ordered=False)
+                break
+            except BulkWriteError as err:
+                errors = err.details.get("writeErrors", [])
+
+                # Everything left was already written by an earlier attempt
+                if attempt > 0 and all(e["code"] == 11000 for e in errors):
+                    break
+                if attempt == Database._WRITE_RETRIES:
+                    raise
+            except Exception:
+                if attempt == Database._WRITE_RETRIES:
+                    raise
+
+            logging.warning(f"Retrying batch of { len(docs) } documents")
+            time.sleep(2**attempt)
+
+        return time.perf_counter() - start
+
+    @staticmethod
+    def write_all(target, data, checkpoint: Checkpoint = None, step: str = None) -> list[float]:
+        """Write documents in chunks with unordered bulk inserts.
+        Documents are converted batch by batch and batches may be
+        written in parallel. With a checkpoint, written batches are
+        marked as completed and skipped when an interrupted run is resumed.
+
+        Args:
+            target (pymongo.collection.Collection): Collection to write into.
+            data (list): List of documents to insert.
+            checkpoint (Checkpoint, optional): Checkpoint of the run.
+            step (str, optional): Step name batches are marked under.
+
+        Returns:
+            list[float]: Time spent on each batch in seconds, None for failed batches.
+        """
+
+        def write(indexed: tuple) -> float:
+            index, batch = indexed
+            name = f"{ step }.{ index }"
+
+            if checkpoint is not None and checkpoint.done(name):
+                return 0.0
+
+            elapsed = Database._write_batch(target, batch)
+
+            if checkpoint is not None:
+                checkpoint.complete(name)
+
+            return elapsed
+
+        with Metrics.stage("insert", len(data)):
+            timings = helpers.map_concurrent(
+                write,
+                enumerate(helpers.chunked(data, Database._BATCH_SIZE)),
+                Database._WRITE_WORKERS,
+            )
+        failed = sum(1 for t in timings if t is None)
+
+        if failed:
+            raise RuntimeError(f"{ failed } of { len(timings) } batches failed")
+
+        return timings
+
+    @staticmethod
+    def insert_all(collection, data, checkpoint: Checkpoint = None) -> list[float]:
         """Insert many documents into collection.
 
         Args:
             collection (MongoDB Document): Collection to insert documents into.
             data (list): List of documents to insert.
+            checkpoint (Checkpoint, optional): Checkpoint of the run, batches
+                written by an interrupted attempt are skipped.
+
+        Returns:
+            list[float]: Time spent on each batch in seconds, None if any batch failed.
+        """
+
+        try:
+            timings = Database.write_all(
+                collection._get_collection(),
+                data,
+                checkpoint,
+                f"insert.{ collection._get_collection_name() }",
+            )
+            logging.info(
+                f"Inserted { len(data) } documents into { collection } in "
+                f"{ len(timings) } batches ({ sum(timings):.2f}s)"
+            )
+            return timings
+        except Exception as err:
+            logging.error(err, exc_info=True)
+            return None
+
+    @staticmethod
+    def _key(doc: dict, fields: tuple) -> tuple:
+        """Build a hashable identity of a document from its key fields."""
+        return tuple(
+            tuple(doc.get(f)) if isinstance(doc.get(f), list) else doc.get(f)
+            for f in fields
+        )
+
+    @staticmethod
+    def _diff_shows(old: dict, new: dict, counts: dict) -> None:
+        """Count inserted, updated and deleted embedded shows
+        of a channel, matching them on oid and start_ts."""
+        old_shows = {
+            (s.get("oid"), s.get("start_ts")): bson.encode(s)
+            for s in old.get("shows", [])
+        }
+        new_shows = {
+            (s.get("oid"), s.get("start_ts")): bson.encode(s)
+            for s in new.get("shows", [])
+        }
+
+        counts["shows_inserted"] += len(new_shows.keys() - old_shows.keys())
+        counts["shows_deleted"] += len(old_shows.keys() - new_shows.keys())
+        counts["shows_updated"] += sum(
+            1
+            for k in new_shows.keys() & old_shows.keys()
+            if new_shows[k] != old_shows[k]
+        )
+
+    @staticmethod
+    def upsert_all(collection, data, key: tuple, query: dict = None) -> dict:
+        """Incrementally sync documents with collection.
+        Documents are matched with stored ones on key fields, only new and
+        changed ones are written and stored documents missing from data
+        are deleted, all in a single unordered bulk write.
+
+        Args:
+            collection (MongoDB Document): Collection to sync documents into.
+            data (list): List of documents to sync.
+            key (tuple): Field names identifying a document.
+            query (dict, optional): Limits stored documents taking part in the diff.
+
+        Returns:
+            dict: Counts of inserted, updated, deleted and unchanged documents
+            and of inserted, updated and deleted embedded shows.
         """
+        counts = dict.fromkeys(
+            [
+                "inserted",
+                "updated",
+                "deleted",
+                "unchanged",
+                "shows_inserted",
+                "shows_updated",
+                "shows_deleted",
+            ],
+            0,
+        )
 
         try:
-            collection.objects.insert(data)
-            logging.info(f"Inserted { len(data) } documents into { collection }")
+            with Metrics.stage("upsert", len(data)):
+                target = collection._get_collection()
+                stored = {}
+
+                for doc in target.find(query or {}):
+                    _id = doc.pop("_id")
+                    stored[Database._key(doc, key)] = (_id, doc)
+
+                operations = []
+
+                for document in data:
+                    doc = dict(Database._to_mongo(document))
+                    match = stored.pop(Database._key(doc, key), None)
+
+                    if match is None:
+                        operations.append(InsertOne(doc))
+                        counts["inserted"] += 1
+                        counts["shows_inserted"] += len(doc.get("shows", []))
+                        continue
+
+                    _id, old = match
+
+                    # Encoded BSON normalizes datetimes to UTC milliseconds
+                    if bson.encode(old) == bson.encode(doc):
+                        counts["unchanged"] += 1
+                        continue
+
+                    operations.append(ReplaceOne({"_id": _id}, doc))
+                    counts["updated"] += 1
+                    Database._diff_shows(old, doc, counts)
+
+                for _id, old in stored.values():
+                    operations.append(DeleteOne({"_id": _id}))
+                    counts["deleted"] += 1
+                    counts["shows_deleted"] += len(old.get("shows", []))
+
+                if operations:
+                    target.bulk_write(operations, ordered=False)
+
+            logging.info(f"Synced { collection }: { counts }")
         except Exception as err:
             logging.error(err, exc_info=True)
 
-        
+        return counts
+
     @staticmethod
     def drop(collection) -> None:
         """Drop collection.
@@ -48,7 +274,253 @@ class Database:
         """
 
         try:
-            collection.drop_collection()
+            with Metrics.stage("drop"):
+                collection.drop_collection()
             logging.info(f"Dropped { collection }")
         except Exception as err:
-            logging.error(err, exc_info=True)
\ No newline at end of file
+            logging.error(err, exc_info=True)
+
+    @staticmethod
+    def _backup(collection) -> None:
+        """Copy live collection into its backup collection server side."""
+        db = collection._get_db()
+        name = collection._get_collection_name()
+
+        if name in db.list_collection_names():
+            db[name].aggregate([{"$match": {}}, {"$out": f"{ name }_previous"}])
+
+    @staticmethod
+    def create_indexes(collection, target) -> None:
+        """Create indexes declared in collection meta on target collection.
+
+        Args:
+            collection (MongoDB Document): Collection declaring the indexes.
+            target (pymongo.collection.Collection): Collection to create them on.
+        """
+        for spec in collection._meta.get("index_specs", []):
+            options = dict(spec)
+            target.create_index(options.pop("fields"), **options)
+
+    @staticmethod
+    def stage(collection) -> tuple:
+        """Create an empty staging collection for collection
+        and start backing up the live one in the background.
+
+        Args:
+            collection (MongoDB Document): Collection to stage.
+
+        Returns:
+            tuple(pymongo.collection.Collection, threading.Thread): Staging collection and backup thread.
+        """
+        db = collection._get_db()
+        staging = db[f"{ collection._get_collection_name() }_staging"]
+        staging.drop()
+        Database.create_indexes(collection, staging)
+
+        # Backup runs concurrently with writes into staging
+        backup = threading.Thread(target=Database._backup, args=(collection,))
+        backup.start()
+
+        return (staging, backup)
+
+    @staticmethod
+    def promote(collection, staging, backup: threading.Thread) -> None:
+        """Atomically rename staging collection over the live one
+        once the backup of the live collection is done.
+
+        Args:
+            collection (MongoDB Document): Collection to replace.
+            staging (pymongo.collection.Collection): Staging collection.
+            backup (threading.Thread): Backup thread started by stage.
+        """
+        backup.join()
+
+        with Metrics.stage("swap"):
+            staging.rename(collection._get_collection_name(), dropTarget=True)
+
+    @staticmethod
+    def swap_all(collection, data) -> None:
+        """Replace collection contents without downtime.
+        Documents are written into a staging collection while the live one
+        is backed up, then staging is atomically renamed over the live
+        collection, so readers never see an empty or partial collection.
+
+        Args:
+            collection (MongoDB Document): Collection to replace.
+            data (list): List of documents to write.
+        """
+
+        try:
+            staging, backup = Database.stage(collection)
+
+            try:
+                if data:
+                    Database.write_all(staging, data)
+            finally:
+                backup.join()
+
+            if not data:
+                logging.error(f"No documents for { collection }, keeping live data")
+                return
+
+            Database.promote(collection, staging, backup)
+            logging.info(f"Swapped { len(data) } documents into { collection }")
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+    @staticmethod
+    def rollback(collection) -> None:
+        """Restore collection from the backup made by the last swap.
+
+        Args:
+            collection (MongoDB Document): Collection to restore.
+        """
+
+        try:
+            db = collection._get_db()
+            name = collection._get_collection_name()
+            db[f"{ name }_previous"].rename(name, dropTarget=True)
+            # Backup copy doesn't carry indexes over
+            Database.create_indexes(collection, db[name])
+            logging.info(f"Rolled back { collection }")
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+    @staticmethod
+    def get_watermark(provider: str) -> int:
+        """Get start of the first day of provider that isn't finalized yet.
+
+        Args:
+            provider (str): Provider name
+
+        Returns:
+            int: Unix timestamp, None if there is no watermark
+        """
+
+        try:
+            watermark = Watermark.objects(provider=provider).first()
+            return watermark.finalized_ts if watermark else None
+        except Exception as err:
+            logging.error(err, exc_info=True)
+            return None
+
+    @staticmethod
+    def set_watermark(provider: str, finalized_ts: int) -> None:
+        """Mark all days of provider before given timestamp as finalized.
+
+        Args:
+            provider (str): Provider name
+            finalized_ts (int): Unix timestamp
+        """
+
+        try:
+            Watermark.objects(provider=provider).update_one(
+                set__finalized_ts=finalized_ts,
+                set__updated_at=pendulum.now("UTC"),
+                upsert=True,
+            )
+            logging.info(f"Watermark of { provider } moved to { finalized_ts }")
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+    @staticmethod
+    def history(provider: str, since: int, until: int) -> dict[int, list[ShowRecord]]:
+        """Load stored shows of provider starting between since and until.
+        Shows are trimmed server side, only matching ones are transferred.
+
+        Args:
+            provider (str): Provider name
+            since (int): Unix timestamp of earliest show start to keep
+            until (int): Unix timestamp of first show start to exclude
+
+        Returns:
+            dict[int, list[ShowRecord]]: Stored shows grouped by channel id
+        """
+        history = {}
+
+        try:
+            cursor = Channel._get_collection().aggregate(
+                [
+                    {"$match": {"provider": provider}},
+                    {
+                        "$project": {
+                            "oid": 1,
+                            "shows": {
+                                "$filter": {
+                                    "input": "$shows",
+                                    "as": "show",
+                                    "cond": {
+                                        "$and": [
+                                            {"$gte": ["$$show.start_ts", since]},
+                                            {"$lt": ["$$show.start_ts", until]},
+                                        ]
+                                    },
+                                }
+                            },
+                        }
+                    },
+                ]
+            )
+
+            for doc in cursor:
+                history[doc["oid"]] = [
+                    ShowRecord.from_mongo(Lookup.expand(show))
+                    for show in doc.get("shows") or []
+                ]
+
+            logging.info(
+                f"Loaded { sum(len(s) for s in history.values()) } stored shows of { provider }"
+            )
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+        return history
+
+    @staticmethod
+    def channels(query: dict = None) -> Iterator[ChannelRecord]:
+        """Stream stored channels with their shows one by one.
+
+        Args:
+            query (dict, optional): Filter of channels to read
+
+        Yields:
+            ChannelRecord: Stored channel with its shows
+        """
+        for doc in Channel._get_collection().find(query or {}, {"_id": 0}):
+            doc["shows"] = [Lookup.expand(show) for show in doc.get("shows") or []]
+            yield ChannelRecord.from_mongo(doc)
+
+    @staticmethod
+    def show_bounds(query: dict = None) -> tuple:
+        """Get earliest start and latest end of stored shows, computed server side.
+
+        Args:
+            query (dict, optional): Filter of channels to look at
+
+        Returns:
+            tuple(int, int): Min start and max end unix timestamps, None if there are no shows
+        """
+        try:
+            result = list(
+                Channel._get_collection().aggregate(
+                    [
+                        {"$match": query or {}},
+                        {"$unwind": "$shows"},
+                        {
+                            "$group": {
+                                "_id": None,
+                                "start": {"$min": "$shows.start_ts"},
+                                "end": {"$max": "$shows.end_ts"},
+                            }
+                        },
+                    ]
+                )
+            )
+        except Exception as err:
+            logging.error(err, exc_info=True)
+            return None
+
+        if not result or result[0]["start"] is None:
+            return None
+
+        return (result[0]["start"], result[0]["end"])
@@ -0,0 +1,251 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator
+from xml.sax.saxutils import escape, quoteattr
+
+from decouple import Csv, config
+from orm.records import ChannelRecord
+from utils import helpers
+from utils.metrics import Metrics
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class Export:
+
+    _DIR = config("EXPORT_DIR", default="")
+    _FORMATS = config("EXPORT_FORMATS", default="xmltv", cast=Csv())
+    _BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=100, cast=int)
+
+    @staticmethod
+    def unique(
+        channels: Iterable[ChannelRecord],
+    ) -> Iterator[tuple[ChannelRecord, list, bool]]:
+        """Yield channels together with their shows not yet exported.
+        Channels and shows listed more than once are only kept once.
+
+        Args:
+            channels (Iterable[ChannelRecord]): Channels with their shows
+
+        Yields:
+            tuple(ChannelRecord, list[ShowRecord], bool): Channel, its new shows
+                and whether the channel is seen for the first time
+        """
+        seen = set()
+        seen_shows = set()
+
+        for channel in channels:
+            key = (channel.provider, channel.oid)
+            shows = []
+
+            for show in channel.shows:
+                show_key = (channel.provider, show.oid, show.start_ts)
+
+                if show_key in seen_shows:
+                    continue
+
+                seen_shows.add(show_key)
+                shows.append(show)
+
+            if key in seen:
+                if shows:
+                    yield (channel, shows, False)
+                continue
+
+            seen.add(key)
+            yield (channel, shows, True)
+
+    @staticmethod
+    def replace(path: str, write) -> None:
+        """Write file through writer function into a temporary file
+        and atomically move it over path, so readers never see a partial file.
+
+        Args:
+            path (str): Destination path
+            write (Callable): Function writing the file given a temporary path
+        """
+        tmp_path = f"{ path }.tmp"
+
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def xmltv_time(ts: int) -> str:
+        """Format unix timestamp as XMLTV date."""
+        return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d%H%M%S %z")
+
+    @staticmethod
+    def write_xmltv(channels: Iterable[ChannelRecord], path: str) -> int:
+        """Stream channels and their shows into a gzip compressed XMLTV file.
+        Channel elements have to precede all programmes, so programmes are
+        spooled to a temporary file while channels are written.
+
+        Args:
+            channels (Iterable[ChannelRecord]): Channels with their shows
+            path (str): Destination path
+
+        Returns:
+            int: Number of exported shows
+        """
+        count = 0
+
+        def write(tmp_path: str) -> None:
+            nonlocal count
+
+            with tempfile.TemporaryFile("w+", encoding="utf-8") as programmes, gzip.open(
+                tmp_path, "wt", encoding="utf-8"
+            ) as file:
+                file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                file.write('<!DOCTYPE tv SYSTEM "xmltv.dtd">\n')
+                file.write('<tv generator-info-name="tv-epg-etl">\n')
+
+                for channel, shows, first in Export.unique(channels):
+                    channel_id = quoteattr(f"{ channel.oid }.{ channel.provider }")
+
+                    if first:
+                        file.write(
+                            f"  <channel id={ channel_id }>"
+                            f"<display-name>{ escape(channel.name or '') }</display-name>"
+                            f"<icon src={ quoteattr(channel.logo or '') } /></channel>\n"
+                        )
+
+                    for show in shows:
+                        programmes.write(
+                            f"  <programme start={ quoteattr(Export.xmltv_time(show.start_ts)) } "
+                            f"stop={ quoteattr(Export.xmltv_time(show.end_ts)) } channel={ channel_id }>"
+                            f"<title>{ escape(show.title or '') }</title>"
+                        )
+
+                        if show.description:
+                            programmes.write(f"<desc>{ escape(show.description) }</desc>")
+
+                        if show.category:
+                            programmes.write(f"<category>{ escape(show.category) }</category>")
+
+                        if show.poster:
+                            programmes.write(f"<icon src={ quoteattr(show.poster) } />")
+
+                        programmes.write("</programme>\n")
+                        count += 1
+
+                programmes.seek(0)
+                shutil.copyfileobj(programmes, file)
+                file.write("</tv>\n")
+
+        Export.replace(path, write)
+        return count
+
+    @staticmethod
+    def schema():
+        """Arrow schema of exported shows, one row per show."""
+        return pyarrow.schema(
+            [
+                ("provider", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                ("channel_oid", pyarrow.int64()),
+                ("channel_name", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                ("channel_logo", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                ("title", pyarrow.string()),
+                ("category", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                ("description", pyarrow.string()),
+                ("start_ts", pyarrow.int64()),
+                ("end_ts", pyarrow.int64()),
+                ("duration", pyarrow.float64()),
+                ("poster", pyarrow.string()),
+            ]
+        )
+
+    @staticmethod
+    def write_parquet(channels: Iterable[ChannelRecord], path: str) -> int:
+        """Stream channels and their shows into a zstd compressed Parquet file,
+        one row group per batch of channels.
+
+        Args:
+            channels (Iterable[ChannelRecord]): Channels with their shows
+            path (str): Destination path
+
+        Returns:
+            int: Number of exported shows
+        """
+        schema = Export.schema()
+        count = 0
+
+        def write(tmp_path: str) -> None:
+            nonlocal count
+
+            with pyarrow.parquet.ParquetWriter(
+                tmp_path, schema, compression="zstd"
+            ) as writer:
+                for batch in helpers.chunked(Export.unique(channels), Export._BATCH_SIZE):
+                    columns = {name: [] for name in schema.names}
+
+                    for channel, shows, _ in batch:
+                        for show in shows:
+                            columns["provider"].append(channel.provider)
+                            columns["channel_oid"].append(channel.oid)
+                            columns["channel_name"].append(channel.name)
+                            columns["channel_logo"].append(channel.logo)
+                            columns["title"].append(show.title)
+                            columns["category"].append(show.category)
+                            columns["description"].append(show.description)
+                            columns["start_ts"].append(show.start_ts)
+                            columns["end_ts"].append(show.end_ts)
+                            columns["duration"].append(show.duration)
+                            columns["poster"].append(show.poster)
+
+                    if columns["start_ts"]:
+                        writer.write_table(pyarrow.table(columns, schema=schema))
+                        count += len(columns["start_ts"])
+
+        Export.replace(path, write)
+        return count
+
+    @staticmethod
+    def export_all(channels: Callable[[], Iterable[ChannelRecord]]) -> None:
+        """Export channels and their shows into every configured format.
+        Export is skipped if EXPORT_DIR isn't set.
+
+        Args:
+            channels (Callable): Function returning a fresh iterable of channels,
+                called once per format so stored channels can be streamed
+        """
+        if not Export._DIR:
+            return
+
+        os.makedirs(Export._DIR, exist_ok=True)
+        writers = {
+            "xmltv": (Export.write_xmltv, "epg.xml.gz"),
+            "parquet": (Export.write_parquet, "epg.parquet"),
+        }
+
+        for name in Export._FORMATS:
+            if name not in writers:
+                logging.error(f"Unknown export format { name }")
+                continue
+
+            if name == "parquet" and pyarrow is None:
+                logging.error("pyarrow isn't installed, skipping Parquet export")
+                continue
+
+            writer, filename = writers[name]
+            path = os.path.join(Export._DIR, filename)
+
+            try:
+                with Metrics.stage(f"export.{ name }"):
+                    count = writer(channels(), path)
+
+                size = os.path.getsize(path) / 2**20
+                logging.info(f"Exported { count } shows to { path } ({ size:.1f} MB)")
+            except Exception as err:
+                logging.error(err, exc_info=True)
@@ -0,0 +1,313 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from services.cache import ResponseCache
+from utils import constants
+from utils.metrics import Metrics
+
+# Statuses worth retrying, the API is throttling us or temporarily down
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Rate limiters shared by all sessions, one per host
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Transport adapter that records responses to fixture files
+    or replays them from fixtures without touching the network."""
+
+    def __init__(self, mode: str, directory: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, request: requests.PreparedRequest) -> str:
+        """Get fixture path for request, ignoring volatile query params."""
+        url = urlsplit(request.url)
+        params = sorted(
+            (k, v)
+            for k, v in parse_qsl(url.query)
+            if k not in constants.REPLAY_IGNORED_PARAMS
+        )
+        key = f"{ request.method } { url.netloc }{ url.path }?{ urlencode(params) }"
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        slug = re.sub(r"[^a-z0-9]+", "-", url.path.lower()).strip("-")
+        return os.path.join(self.directory, f"{ slug }-{ digest }.json")
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.mode == "replay":
+            return self.replay(request)
+
+        response = super().send(request, **kwargs)
+
+        with open(self.path(request), "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "method": request.method,
+                    "url": request.url,
+                    "status": response.status_code,
+                    "headers": {
+                        k: v
+                        for k, v in response.headers.items()
+                        if k.lower() not in constants.REPLAY_REDACTED_HEADERS
+                    },
+                    "body": self.redact(response.content.decode("utf-8", errors="replace")),
+                },
+                file,
+            )
+
+        return response
+
+    @staticmethod
+    def redact(body: str) -> str:
+        """Mask credentials in a JSON response body, so fixtures can be shared.
+
+        Args:
+            body (str): Response body
+
+        Returns:
+            str: Body with credential fields masked
+        """
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return body
+
+        if not isinstance(data, dict) or not constants.REPLAY_REDACTED_FIELDS & data.keys():
+            return body
+
+        return json.dumps(
+            {
+                k: "redacted" if k in constants.REPLAY_REDACTED_FIELDS else v
+                for k, v in data.items()
+            }
+        )
+
+    def replay(self, request: requests.PreparedRequest) -> requests.Response:
+        """Build response for request from its fixture file."""
+        try:
+            with open(self.path(request), encoding="utf-8") as file:
+                fixture = json.load(file)
+        except FileNotFoundError:
+            raise requests.ConnectionError(f"No fixture for { request.url }") from None
+
+        headers = CaseInsensitiveDict(fixture["headers"])
+        # Body is stored decoded
+        headers.pop("Content-Encoding", None)
+
+        response = requests.Response()
+        response.status_code = fixture["status"]
+        response.headers = headers
+        response._content = fixture["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(0)
+        return response
+
+
+class TokenBucket:
+    """Thread safe token bucket limiting the request rate to a single host.
+    The rate is halved whenever the host throttles us and creeps back
+    up to the configured rate with every successful response."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, sleeping until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens go negative to reserve a slot for every waiting caller
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+    def throttle(self) -> None:
+        """Halve the rate, down to a tenth of the configured one."""
+        with self._lock:
+            self.rate = max(self.rate / 2, self.max_rate / 10)
+
+    def recover(self) -> None:
+        """Raise the rate back towards the configured one."""
+        with self._lock:
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+def get_bucket(host: str) -> TokenBucket:
+    """Get rate limiter shared by all requests to host, None if rate limiting is disabled.
+
+    Args:
+        host (str): Host name
+
+    Returns:
+        TokenBucket: Rate limiter of host
+    """
+    rate = config("HTTP_RATE_LIMIT", default=10, cast=float)
+
+    if rate <= 0:
+        return None
+
+    with _buckets_lock:
+        if host not in _buckets:
+            burst = config("HTTP_RATE_BURST", default=10, cast=int)
+            _buckets[host] = TokenBucket(rate, max(1, burst))
+        return _buckets[host]
+
+
+class Client(requests.Session):
+    """Session with explicit connect/read timeouts, per-host rate limits
+    and retries of single requests with jittered exponential backoff."""
+
+    def __init__(self, retries: int, backoff: float, max_backoff: float, timeout: tuple) -> None:
+        super().__init__()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def delay(self, attempt: int, response: requests.Response = None) -> float:
+        """Seconds to wait before next attempt, honoring Retry-After.
+
+        Args:
+            attempt (int): Number of the failed attempt, starting from 0
+            response (requests.Response, optional): Response of the failed attempt
+
+        Returns:
+            float: Seconds to wait
+        """
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+
+            if retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), self.max_backoff))
+
+        return delay
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        bucket = get_bucket(urlsplit(url).netloc)
+        attempt = 0
+
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt >= self.retries:
+                    raise
+                delay = self.delay(attempt)
+                logging.warning(f"{ method } { url } failed ({ err }), retrying in { delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    if bucket is not None and response.status_code < 400:
+                        bucket.recover()
+                    return response
+
+                if bucket is not None and response.status_code == 429:
+                    bucket.throttle()
+
+                delay = self.delay(attempt, response)
+                logging.warning(
+                    f"{ method } { url } returned { response.status_code }, retrying in { delay:.1f}s"
+                )
+
+            attempt += 1
+            time.sleep(delay)
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """Create a keep-alive client with a connection pool
+    large enough to be shared by pool_size concurrent workers.
+    Responses are recorded to or replayed from fixtures if HTTP_REPLAY_MODE is set.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections per host
+
+    Returns:
+        requests.Session: Pooled client
+    """
+    mode = config("HTTP_REPLAY_MODE", default="off")
+    session = Client(
+        # Replayed fixtures never change, retrying a missing one is pointless
+        retries=0 if mode == "replay" else config("HTTP_RETRIES", default=3, cast=int),
+        backoff=config("HTTP_BACKOFF", default=0.5, cast=float),
+        max_backoff=config("HTTP_BACKOFF_MAX", default=30, cast=float),
+        timeout=(
+            config("HTTP_CONNECT_TIMEOUT", default=5, cast=float),
+            config("HTTP_READ_TIMEOUT", default=30, cast=float),
+        ),
+    )
+
+    if mode in ("record", "replay"):
+        adapter = ReplayAdapter(
+            mode,
+            config("HTTP_FIXTURES_DIR", default="fixtures"),
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(Metrics.record_response)
+    return session
+
+
+def get_json(
+    session: requests.Session,
+    url: str,
+    params: dict = None,
+    headers: dict = None,
+    cache: ResponseCache = None,
+    ttl: int = 0,
+) -> dict | list:
+    """GET JSON response, going through the response cache when one is given.
+
+    Args:
+        session (requests.Session): Session to send requests with
+        url (str): URL to fetch
+        params (dict, optional): Query params
+        headers (dict, optional): Request headers
+        cache (ResponseCache, optional): Response cache
+        ttl (int, optional): Seconds a cached response stays fresh
+
+    Returns:
+        dict | list: Decoded JSON response
+    """
+    if cache is not None:
+        return cache.get_json(session, url, params=params, headers=headers, ttl=ttl)
+
+    response = session.get(url, params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
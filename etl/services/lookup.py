@@ -0,0 +1,131 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+
+from decouple import config
+from orm.models import Reference
+from utils import constants
+
+
+class Lookup:
+    """Replaces repeated show values with small integer references.
+    Categories and whole default posters are referenced by value, other
+    absolute posters by their scheme and host, keeping only the path inline.
+    References are never reassigned, so stored documents stay readable."""
+
+    _ENABLED = config("COMPACT_SHOWS", default=False, cast=bool)
+    _lock = threading.Lock()
+    _refs = None
+    _values = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return Lookup._ENABLED
+
+    @staticmethod
+    def _load() -> None:
+        """Read stored references on first use."""
+        Lookup._refs = {}
+        Lookup._values = {}
+
+        for doc in Reference._get_collection().find({}, {"_id": 0}):
+            Lookup._refs[(doc["kind"], doc["value"])] = doc["ref"]
+            Lookup._values[(doc["kind"], doc["ref"])] = doc["value"]
+
+    @staticmethod
+    def ref(kind: str, value: str) -> int:
+        """Get reference of value, storing it if it's new.
+
+        Args:
+            kind (str): Field the value belongs to
+            value (str): Value to reference
+
+        Returns:
+            int: Reference of value
+        """
+        with Lookup._lock:
+            if Lookup._refs is None:
+                Lookup._load()
+
+            ref = Lookup._refs.get((kind, value))
+
+            if ref is None:
+                ref = 1 + max((r for k, r in Lookup._values if k == kind), default=0)
+                Reference._get_collection().insert_one(
+                    {"kind": kind, "ref": ref, "value": value}
+                )
+                Lookup._refs[(kind, value)] = ref
+                Lookup._values[(kind, ref)] = value
+                logging.info(f"New { kind } reference #{ ref }: { value }")
+
+            return ref
+
+    @staticmethod
+    def value(kind: str, ref: int) -> str:
+        """Get value of reference."""
+        with Lookup._lock:
+            if Lookup._refs is None:
+                Lookup._load()
+
+            return Lookup._values[(kind, ref)]
+
+    @staticmethod
+    def compact(show: dict) -> dict:
+        """Replace poster and category of a raw show with references,
+        returns show as is if COMPACT_SHOWS isn't enabled.
+
+        Args:
+            show (dict): Raw show document
+
+        Returns:
+            dict: Compacted show document
+        """
+        if not Lookup.enabled():
+            return show
+
+        show = dict(show)
+        poster = show.pop("poster", None)
+        category = show.pop("category", None)
+
+        url = urlsplit(poster) if poster else None
+
+        if poster == constants.DEFAULT_IMG:
+            show["poster_ref"] = Lookup.ref("poster", poster)
+        elif url and url.scheme and url.netloc:
+            prefix = f"{ url.scheme }://{ url.netloc }"
+            show["poster_ref"] = Lookup.ref("poster", prefix)
+            show["poster"] = poster[len(prefix):]
+        else:
+            # Relative and empty posters have no host to reference
+            show["poster"] = poster
+
+        if category is not None:
+            show["category_ref"] = Lookup.ref("category", category)
+        else:
+            show["category"] = category
+
+        return show
+
+    @staticmethod
+    def expand(show: dict) -> dict:
+        """Restore full poster and category of a compacted raw show.
+
+        Args:
+            show (dict): Raw show document, compacted or not
+
+        Returns:
+            dict: Show document with full values
+        """
+        if "poster_ref" not in show and "category_ref" not in show:
+            return show
+
+        show = dict(show)
+
+        if "poster_ref" in show:
+            show["poster"] = Lookup.value("poster", show.pop("poster_ref")) + (
+                show.get("poster") or ""
+            )
+        if "category_ref" in show:
+            show["category"] = Lookup.value("category", show.pop("category_ref"))
+
+        return show
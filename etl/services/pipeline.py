@@ -0,0 +1,210 @@
+import logging
+import queue
+import threading
+import time
+
+from decouple import config
+from orm.models import Channel, ScheduledShow
+from orm.records import ShowRecord
+from pymongo import UpdateMany
+from services.db import Database
+from services.lookup import Lookup
+from utils import helpers
+
+# Marks the end of a producer's stream
+_DONE = object()
+
+
+class Pipeline:
+    """Streams scraped batches into the database as they arrive.
+    Every scraper produces on its own thread into a bounded buffer,
+    so fetching, parsing and writing overlap and only a few batches
+    are held in memory at any time."""
+
+    def __init__(
+        self,
+        scrapers: list,
+        watermarks: dict = None,
+        histories: dict = None,
+        flat: bool = False,
+    ) -> None:
+        self.scrapers = scrapers
+        self.flat = flat
+        self.watermarks = watermarks or {}
+        self.histories = histories or {}
+        self.buffer = queue.Queue(maxsize=config("PIPELINE_BUFFER", default=4, cast=int))
+        self.providers = set()
+        self.channels = 0
+        self.shows = 0
+        self.bounds = None
+
+    def produce(self, scraper) -> None:
+        """Put batches streamed by a scraper into the buffer.
+
+        Args:
+            scraper (MTS | SBB): Scraper to stream from
+        """
+        try:
+            for batch in scraper.stream(self.watermarks.get(scraper.provider)):
+                self.buffer.put((scraper.provider, batch))
+        except Exception as err:
+            logging.error(err, exc_info=True)
+        finally:
+            self.buffer.put((scraper.provider, _DONE))
+
+    def track(self, shows: list[ShowRecord]) -> None:
+        """Keep track of show count and earliest start and latest end of shows."""
+        self.shows += len(shows)
+        bounds = helpers.show_bounds(shows)
+
+        if bounds is None:
+            return
+
+        if self.bounds is None:
+            self.bounds = bounds
+        else:
+            self.bounds = (min(self.bounds[0], bounds[0]), max(self.bounds[1], bounds[1]))
+
+    @staticmethod
+    def push(staging, provider: str, shows: list[ShowRecord]) -> None:
+        """Append shows to their already written channels.
+
+        Args:
+            staging (pymongo.collection.Collection): Collection holding the channels
+            provider (str): Provider of the shows
+            shows (list[ShowRecord]): Shows to append
+        """
+        operations = [
+            UpdateMany(
+                {"provider": provider, "oid": oid},
+                {
+                    "$push": {
+                        "shows": {
+                            "$each": [Lookup.compact(show.to_mongo()) for show in group]
+                        }
+                    }
+                },
+            )
+            for oid, group in helpers.group_by_oid(shows).items()
+        ]
+        staging.bulk_write(operations, ordered=False)
+
+    def abandon(self, provider: str, staging, flat_staging=None) -> None:
+        """Drop partially written data of a timed out provider from staging.
+
+        Args:
+            provider (str): Provider to drop
+            staging (pymongo.collection.Collection): Collection holding channels
+            flat_staging (pymongo.collection.Collection, optional): Collection holding flattened shows
+        """
+        logging.error(f"{ provider } timed out, dropping its partial data")
+        self.providers.discard(provider)
+        self.channels -= staging.delete_many({"provider": provider}).deleted_count
+
+        if flat_staging is not None:
+            flat_staging.delete_many({"provider": provider})
+
+    def consume(self, staging, flat_staging=None) -> None:
+        """Write batches from the buffer until every scraper is done.
+
+        Args:
+            staging (pymongo.collection.Collection): Collection to write channels into
+            flat_staging (pymongo.collection.Collection, optional): Collection to write flattened shows into
+        """
+        start = time.monotonic()
+        deadlines = {
+            scraper.provider: start + scraper.timeout for scraper in self.scrapers
+        }
+
+        while deadlines:
+            try:
+                wait = max(0, min(deadlines.values()) - time.monotonic())
+                item = self.buffer.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            # Abandon stalled providers, keep writing the others
+            for provider, deadline in list(deadlines.items()):
+                if deadline <= time.monotonic():
+                    self.abandon(provider, staging, flat_staging)
+                    del deadlines[provider]
+
+            if item is None:
+                continue
+
+            provider, batch = item
+
+            if provider not in deadlines:
+                continue
+
+            if batch is _DONE:
+                del deadlines[provider]
+                continue
+
+            channels, shows = batch
+
+            if channels:
+                helpers.merge_history(channels, self.histories.get(provider, {}))
+                Database.write_all(staging, channels)
+                self.providers.add(provider)
+
+                if flat_staging is not None:
+                    Database.write_all(flat_staging, helpers.flatten_shows(channels))
+
+                self.channels += len(channels)
+                for channel in channels:
+                    self.track(channel.shows)
+
+            if shows:
+                self.push(staging, provider, shows)
+
+                if flat_staging is not None:
+                    Database.write_all(
+                        flat_staging,
+                        [{**show.to_mongo(), "provider": provider} for show in shows],
+                    )
+
+                self.track(shows)
+
+    def run(self) -> tuple:
+        """Stream all scrapers into a staging collection and swap it
+        in place of the live channel collection.
+
+        Returns:
+            tuple(int, int): Earliest show start and latest show end, None if nothing was written
+        """
+        staging, backup = Database.stage(Channel)
+        flat_staging, flat_backup = (
+            Database.stage(ScheduledShow) if self.flat else (None, None)
+        )
+        producers = [
+            threading.Thread(target=self.produce, args=(scraper,), daemon=True)
+            for scraper in self.scrapers
+        ]
+
+        for producer in producers:
+            producer.start()
+
+        try:
+            self.consume(staging, flat_staging)
+        finally:
+            backup.join()
+
+            if flat_backup is not None:
+                flat_backup.join()
+
+        if not self.channels:
+            logging.error("No channels streamed, keeping live data")
+            return None
+
+        Database.promote(Channel, staging, backup)
+
+        if self.flat:
+            Database.promote(ScheduledShow, flat_staging, flat_backup)
+
+        logging.info(
+            f"Streamed { self.channels } channels with total { self.shows } shows "
+            f"(peak memory { helpers.peak_rss_mb():.1f} MB)"
+        )
+
+        return self.bounds
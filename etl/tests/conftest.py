@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import mongoengine
+import pytest
+
+# Modules are imported relative to etl, like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings read on import, tests never touch a real database or API
+for key, value in {
+    "DB_HOST": "localhost",
+    "DB_NAME": "etl_test",
+    "DB_USER": "",
+    "DB_PSWD": "",
+    "SBB_BASIC_TOKEN": "",
+    "HTTP_RETRIES": "0",
+    "HTTP_RATE_LIMIT": "0",
+    "HTTP_REPLAY_MODE": "off",
+    "HTTP_CACHE_DIR": "",
+}.items():
+    os.environ.setdefault(key, value)
+
+
+class StubServer:
+    """Local mts API stub answering every request after a delay.
+    Tracks requests in flight, so tests can check concurrency limits."""
+
+    def __init__(self) -> None:
+        self.delays = {}
+        self.failing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{ self._server.server_port }/oec/epg"
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                key = query.get("date") or query.get("category") or url.path
+
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+
+                try:
+                    time.sleep(stub.delays.get(key, 0.05))
+
+                    if key in stub.failing:
+                        self.send_response(500)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+
+                    body = json.dumps(stub.respond(url.path, query)).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+    def respond(self, path: str, query: dict):
+        if path.endswith("/categories"):
+            return [{"id": i, "text": f"Category {i}"} for i in range(1, 4)]
+
+        if path.endswith("/dates"):
+            return [{"value": f"2022-06-{day:02d}"} for day in range(1, 9)]
+
+        if "category" in query:
+            oid = int(query["category"])
+            return {
+                "channels": [
+                    {"id": str(oid), "name": f"Channel {oid}", "image": "", "category": "Film"}
+                ]
+            }
+
+        date = query["date"]
+        return {
+            "channels": [
+                {
+                    "items": [
+                        {
+                            "title": date,
+                            "category": "Film",
+                            "description": "",
+                            "full_start": f"{date} 10:00:00",
+                            "full_end": f"{date} 11:00:00",
+                            "duration": "60",
+                            "image": "",
+                            "id_channel": "1",
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def mongo():
+    """In-memory database the default connection points to."""
+    mongoengine.connect("etl_test", host="mongomock://localhost")
+    yield
+    mongoengine.get_connection().drop_database("etl_test")
+    mongoengine.disconnect()
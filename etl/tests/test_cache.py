@@ -0,0 +1,60 @@
+import os
+import threading
+
+from services import cache as cache_module
+from services.cache import ResponseCache
+
+
+def count_scans(monkeypatch) -> list:
+    scans = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(cache_module.os, "scandir", counting_scandir)
+    return scans
+
+
+def test_store_only_scans_once_cache_is_full(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), 1000)
+    scans = count_scans(monkeypatch)
+    entry = {"stored_at": 0, "body": "x" * 100}
+
+    for key in range(5):
+        cache.store(cache.path(f"/page/{ key }"), entry)
+
+    # Rewriting an entry only counts the change in size
+    cache.store(cache.path("/page/0"), entry)
+    assert scans == []
+
+    for key in range(5, 10):
+        os.utime(cache.path(f"/page/{ key - 5 }"), (key, key))
+        cache.store(cache.path(f"/page/{ key }"), entry)
+
+    assert scans
+    assert cache._bytes <= 1000
+    assert cache._bytes == sum(size for _, size, _ in cache.entries())
+    # Least recently used entries are evicted first
+    assert not os.path.exists(cache.path("/page/0"))
+    assert os.path.exists(cache.path("/page/9"))
+
+
+def test_counters_are_not_lost_across_threads(tmp_path):
+    cache = ResponseCache(str(tmp_path), 2**20)
+    path = cache.path("/page")
+    cache.store(path, {"stored_at": 2**40, "body": []})
+
+    def hit() -> None:
+        for _ in range(1000):
+            cache.get_json(None, "/page", ttl=2**40)
+
+    threads = [threading.Thread(target=hit) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.hits == 8000
@@ -0,0 +1,39 @@
+import pytest
+
+from services.lookup import Lookup
+from utils import constants
+
+
+@pytest.fixture
+def lookup(mongo, monkeypatch):
+    monkeypatch.setattr(Lookup, "_ENABLED", True)
+    monkeypatch.setattr(Lookup, "_refs", None)
+    monkeypatch.setattr(Lookup, "_values", None)
+
+
+@pytest.mark.parametrize(
+    "poster, referenced",
+    [
+        ("https://images.example.com/shows/1.jpg", True),
+        ("/images/show.jpg", False),
+        ("images/show.jpg", False),
+        ("", False),
+        (None, False),
+        (constants.DEFAULT_IMG, True),
+    ],
+)
+def test_poster_round_trip(lookup, poster, referenced):
+    show = {"title": "Show", "poster": poster, "category": "Film"}
+
+    compact = Lookup.compact(show)
+
+    assert ("poster_ref" in compact) is referenced
+    assert Lookup.expand(compact) == show
+
+
+def test_hosts_share_a_reference(lookup):
+    first = Lookup.compact({"poster": "https://images.example.com/1.jpg", "category": None})
+    second = Lookup.compact({"poster": "https://images.example.com/2.jpg", "category": None})
+
+    assert first["poster_ref"] == second["poster_ref"]
+    assert (first["poster"], second["poster"]) == ("/1.jpg", "/2.jpg")
@@ -0,0 +1,95 @@
+import pendulum
+
+from orm.records import ShowRecord
+from utils import helpers
+
+
+def create_show(title: str, start: str, end: str, description: str = "") -> ShowRecord:
+    start_dt = pendulum.parse(f"2022-06-01 {start}", tz="Europe/Belgrade")
+    end_dt = pendulum.parse(f"2022-06-01 {end}", tz="Europe/Belgrade")
+    return ShowRecord(
+        title,
+        "Film",
+        description,
+        start_dt,
+        end_dt,
+        start_dt.int_timestamp,
+        end_dt.int_timestamp,
+        (end_dt.int_timestamp - start_dt.int_timestamp) / 60,
+        "",
+        1,
+    )
+
+
+def timeline(shows: list[ShowRecord]) -> list[tuple]:
+    return [
+        (show.title, show.start_dt.format("HH:mm"), show.end_dt.format("HH:mm")) for show in shows
+    ]
+
+
+def assert_no_overlaps(shows: list[ShowRecord]) -> None:
+    for previous, show in zip(shows, shows[1:]):
+        assert previous.end_ts <= show.start_ts
+        assert show.duration == (show.end_ts - show.start_ts) / 60
+
+
+def test_partial_overlap_trims_poorer_show():
+    primary = [create_show("A", "10:00", "11:00"), create_show("B", "11:00", "12:00")]
+    others = [create_show("X", "10:50", "11:40", "Richer description")]
+
+    merged = helpers.merge_shows(primary, others, 1)
+
+    assert_no_overlaps(merged)
+    # X fills the slot of B, A is trimmed up to it
+    assert timeline(merged) == [("A", "10:00", "10:50"), ("X", "10:50", "11:40")]
+
+
+def test_partial_overlap_trims_other_show():
+    primary = [create_show("A", "10:00", "11:00", "Richer description")]
+    others = [create_show("X", "10:50", "12:00")]
+
+    merged = helpers.merge_shows(primary, others, 1)
+
+    assert_no_overlaps(merged)
+    assert timeline(merged) == [("A", "10:00", "11:00"), ("X", "11:00", "12:00")]
+    assert merged[1].oid == 1
+
+
+def test_contained_shows_fill_the_same_slot():
+    primary = [create_show("Movie", "10:00", "12:00", "Richer description")]
+    others = [create_show("Part 1", "10:00", "11:00"), create_show("Part 2", "11:00", "12:00")]
+
+    merged = helpers.merge_shows(primary, others, 1)
+
+    assert timeline(merged) == [("Movie", "10:00", "12:00")]
+
+
+def test_richer_contained_shows_replace_container():
+    primary = [create_show("Movie", "10:00", "12:00")]
+    others = [
+        create_show("Part 1", "10:00", "11:00", "Richer description"),
+        create_show("Part 2", "11:00", "12:00", "Richer description"),
+    ]
+
+    merged = helpers.merge_shows(primary, others, 1)
+
+    assert_no_overlaps(merged)
+    assert timeline(merged) == [("Part 1", "10:00", "11:00"), ("Part 2", "11:00", "12:00")]
+
+
+def test_primary_wins_ties():
+    primary = [create_show("Primary", "10:00", "11:00")]
+    others = [create_show("Other", "10:00", "11:00"), create_show("Late", "10:05", "11:05")]
+
+    merged = helpers.merge_shows(primary, others, 1)
+
+    assert timeline(merged) == [("Primary", "10:00", "11:00")]
+
+
+def test_primary_shows_are_not_modified():
+    primary = [create_show("A", "10:00", "11:00")]
+    others = [create_show("X", "10:50", "11:40", "Richer description")]
+
+    helpers.merge_shows(primary, others, 1)
+
+    assert timeline(primary) == [("A", "10:00", "11:00")]
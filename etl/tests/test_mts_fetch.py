@@ -0,0 +1,50 @@
+import time
+
+from scrapers.mts import MTS
+
+
+def create_scraper(server, max_workers: int) -> MTS:
+    scraper = MTS()
+    scraper.base_url = server.url
+    scraper.max_workers = max_workers
+    return scraper
+
+
+def test_fetch_data_keeps_date_order(stub_server):
+    # Earlier dates answer last, results still follow the order of dates
+    stub_server.delays = {f"2022-06-{day:02d}": 0.05 * (9 - day) for day in range(1, 9)}
+    scraper = create_scraper(stub_server, 8)
+
+    data = scraper.fetch_data()
+
+    assert [show["title"] for show in data["shows"]] == [
+        f"2022-06-{day:02d}" for day in range(1, 9)
+    ]
+    assert [channel["id"] for channel in data["channels"]] == ["1", "2", "3"]
+
+
+def test_failed_requests_are_skipped(stub_server):
+    stub_server.failing = {"2022-06-03", "2"}
+    scraper = create_scraper(stub_server, 4)
+
+    data = scraper.fetch_data()
+
+    assert [show["title"] for show in data["shows"]] == [
+        f"2022-06-{day:02d}" for day in range(1, 9) if day != 3
+    ]
+    assert [channel["id"] for channel in data["channels"]] == ["1", "3"]
+    assert scraper.failed_since is not None
+
+
+def test_concurrency_is_capped_by_max_workers(stub_server):
+    stub_server.delays = {f"2022-06-{day:02d}": 0.2 for day in range(1, 9)}
+    scraper = create_scraper(stub_server, 3)
+
+    start = time.perf_counter()
+    data = scraper.fetch_data()
+    elapsed = time.perf_counter() - start
+
+    assert len(data["shows"]) == 8
+    assert stub_server.max_in_flight == 3
+    # 8 dates at 0.2s each take 1.6s one by one, 3 workers need 3 rounds
+    assert elapsed < 1.2
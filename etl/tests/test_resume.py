@@ -0,0 +1,65 @@
+import pendulum
+import pytest
+
+import main
+from orm.models import Channel, Date
+from orm.records import ChannelRecord, ShowRecord
+from services.checkpoint import Checkpoint
+from services.db import Database
+
+
+def create_channels(count: int) -> list[ChannelRecord]:
+    start = pendulum.datetime(2022, 6, 1, 10, tz="Europe/Belgrade")
+    end = start.add(hours=1)
+    show = ShowRecord(
+        "Show", "Film", "", start, end, start.int_timestamp, end.int_timestamp, 60.0, "", 0
+    )
+    return [ChannelRecord(oid, "mts", f"Channel { oid }", "", ["film"], [show]) for oid in range(count)]
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Write batches of two documents without retries, recording channels written."""
+    monkeypatch.setattr(Database, "_BATCH_SIZE", 2)
+    monkeypatch.setattr(Database, "_WRITE_RETRIES", 0)
+    monkeypatch.setattr(main, "FLAT_SHOWS", False)
+    monkeypatch.setattr(main, "SNAPSHOTS", False)
+    write_batch = Database._write_batch
+    written = []
+    failing = {"oid": 3}
+
+    def write(target, batch):
+        oids = [doc.oid for doc in batch if isinstance(doc, ChannelRecord)]
+
+        if failing["oid"] in oids:
+            raise ConnectionError("Connection reset")
+
+        written.extend(oids)
+        return write_batch(target, batch)
+
+    monkeypatch.setattr(Database, "_write_batch", staticmethod(write))
+    return (written, failing)
+
+
+def test_failed_batch_is_resumed(mongo, batches, tmp_path):
+    written, failing = batches
+    channels = create_channels(6)
+    checkpoint = Checkpoint(str(tmp_path), 3600)
+    checkpoint.store_channels(channels)
+
+    assert main.load(channels, [], "full", checkpoint) is False
+    assert not checkpoint.done("load")
+    assert sorted(written) == [0, 1, 4, 5]
+
+    # Next run picks up the stored channels and only writes the failed batch
+    failing["oid"] = None
+    written.clear()
+    resumed = Checkpoint(str(tmp_path), 3600)
+    channels = resumed.load_channels()
+
+    assert main.load(channels, [], "full", resumed) is True
+    assert resumed.done("load")
+    assert written == [2, 3]
+    assert sorted(Channel._get_collection().distinct("oid")) == list(range(6))
+    assert Channel._get_collection().count_documents({}) == 6
+    assert Date._get_collection().count_documents({}) == 1
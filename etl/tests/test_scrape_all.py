@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+import main
+from scrapers.base import Provider
+
+
+class SlowProvider(Provider):
+    """Unregistered provider whose scrape blocks until released."""
+
+    def __init__(self) -> None:
+        self.provider = "slow"
+        self.calls = 0
+        self.release = threading.Event()
+
+    @property
+    def timeout(self) -> int:
+        return 0
+
+    def scrape(self, since: int = None) -> list:
+        self.calls += 1
+        self.release.wait(5)
+        return ["channel"]
+
+    def stream(self, since: int = None):
+        yield from ()
+
+
+def test_timed_out_scrape_blocks_the_next_one():
+    provider = SlowProvider()
+
+    assert main.scrape_all([provider], {}) == {}
+    assert provider.running
+
+    # Abandoned scrape still runs, the provider isn't scraped twice
+    assert main.scrape_all([provider], {}) == {}
+    assert provider.calls == 1
+
+    provider.release.set()
+    deadline = time.monotonic() + 1
+
+    while provider.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert not provider.running
+    provider.release.clear()
+    assert main.scrape_all([provider], {}) == {}
+    assert provider.calls == 2
+    provider.release.set()
+
+
+def test_incomplete_provider_fails_on_instantiation():
+    class Incomplete(Provider):
+        def scrape(self, since: int = None) -> list:
+            return []
+
+    with pytest.raises(TypeError, match="stream"):
+        Incomplete()
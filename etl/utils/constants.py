@@ -1 +1,35 @@
 DEFAULT_IMG = "https://images.unsplash.com/photo-1593784991188-c899ca07263b?ixlib=rb-1.2.1&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=640&q=50"
+
+# Seconds a cached response of each endpoint stays fresh
+CACHE_TTL = {
+    "categories": 24 * 60 * 60,
+    "dates": 60 * 60,
+    "channels": 24 * 60 * 60,
+    "program": 15 * 60,
+    "epg": 15 * 60,
+}
+
+# Query params that change between runs and are left out of fixture keys
+REPLAY_IGNORED_PARAMS = {"fromTime", "toTime"}
+
+# Response fields holding credentials, masked before responses are recorded
+REPLAY_REDACTED_FIELDS = {"access_token", "refresh_token", "id_token"}
+REPLAY_REDACTED_HEADERS = {"set-cookie", "authorization"}
+
+# Snapshot category holding every channel of the day
+SNAPSHOT_ALL = "all"
+
+# Show fields kept in day snapshots, description is left for the channel view
+SNAPSHOT_SHOW_FIELDS = (
+    "title",
+    "category",
+    "start_dt",
+    "end_dt",
+    "start_ts",
+    "end_ts",
+    "duration",
+    "poster",
+)
+
+# Trailing channel name tokens ignored when matching channels across providers
+CHANNEL_NAME_SUFFIXES = {"hd", "fhd", "uhd", "sd", "4k"}
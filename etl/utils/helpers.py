@@ -1,47 +1,539 @@
-import datetime
+import dataclasses
 import logging
+import math
+import multiprocessing
+import re
+import resource
+import threading
+import time
+import unicodedata
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Iterator
 
 import pendulum
-from orm.models import Channel
+from orm.records import ChannelRecord, ShowRecord
+from utils import constants
 
 
-# function to return all dates between two dates
-def daterange(start_date: datetime, end_date: datetime) -> list:
-    """Returns a list of dates between two dates
+# Process pool shared by all parallel parse calls, created on first use
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Smallest chunk worth sending to a worker process
+MIN_CHUNK_SIZE = 500
+
+
+def daterange(start_ts: int, end_ts: int, tz: str = "Europe/Belgrade") -> list:
+    """Returns starts of all days overlapping the interval between two timestamps
 
     Args:
-        start_date (datetime): start date
-        end_date (datetime): end date
+        start_ts (int): start unix timestamp
+        end_ts (int): end unix timestamp, exclusive
+        tz (str, optional): timezone days are counted in
 
     Returns:
-        list[datetime]: list of dates between two dates
+        list[DateTime]: list of day starts, first to last
     """
+    date = pendulum.from_timestamp(start_ts, tz=tz).start_of("day")
+    last = pendulum.from_timestamp(max(start_ts, end_ts - 1), tz=tz).start_of("day")
     dates = []
 
-    for n in range(int((end_date - start_date).days)):
-        date = start_date + pendulum.duration(days=n)
-        dates.append(date.start_of("day"))
+    while date <= last:
+        dates.append(date)
+        date = date.add(days=1)
+
     logging.info(f"{len(dates)} dates generated")
     return dates
 
 
-def min_max_date(channels: list[Channel]) -> tuple:
-    """Returns the min and max dates available in a list of channels
+def show_bounds(shows: list[ShowRecord]) -> tuple:
+    """Returns the earliest start and the latest end of shows
 
     Args:
-        channels (list[Channel]): list of channels
+        shows (list[ShowRecord]): list of shows
 
     Returns:
-        tuple(datetime, datetime): min and max dates
+        tuple(int, int): min start and max end unix timestamps, None if there are no shows
     """
-    dates = []
+    if not shows:
+        return None
+
+    # min / max over attrgetter maps run in C without building lists
+    return (
+        min(map(attrgetter("start_ts"), shows)),
+        max(map(attrgetter("end_ts"), shows)),
+    )
+
+
+def min_max_ts(channels: Iterable[ChannelRecord]) -> tuple:
+    """Returns the earliest start and the latest end of shows of all channels
+
+    Args:
+        channels (Iterable[ChannelRecord]): list of channels
+
+    Returns:
+        tuple(int, int): min start and max end unix timestamps, None if there are no shows
+    """
+    bounds = [b for b in map(show_bounds, map(attrgetter("shows"), channels)) if b]
+
+    if not bounds:
+        return None
+
+    min_ts = min(start for start, _ in bounds)
+    max_ts = max(end for _, end in bounds)
+
+    logging.info(f"Min timestamp is: {min_ts} and max timestamp is: {max_ts}")
+    return (min_ts, max_ts)
+
+
+def group_by_oid(shows: list[ShowRecord]) -> dict[int, list[ShowRecord]]:
+    """Buckets shows by their channel id in a single pass,
+    preserving the original order of shows within each bucket.
+
+    Args:
+        shows (list[ShowRecord]): list of shows
+
+    Returns:
+        dict[int, list[ShowRecord]]: shows grouped by channel id
+    """
+    grouped = defaultdict(list)
+
+    for show in shows:
+        grouped[show.oid].append(show)
+
+    return grouped
+
+
+def _safe_call(func: Callable, item: Any) -> Any:
+    """Calls function with item, logging a failure and returning None instead."""
+    try:
+        return func(item)
+    except Exception as err:
+        logging.error(err, exc_info=True)
+        return None
+
+
+def imap_concurrent(func: Callable, items: Iterable, max_workers: int) -> Iterator:
+    """Lazily applies a function to every item on a thread pool.
+    Results are yielded in the order of the input items and at most
+    max_workers calls are in flight, so unconsumed results stay bounded.
+    A failing call is logged and yields None instead of failing the whole run.
+
+    Args:
+        func (Callable): function to apply to each item
+        items (Iterable): items to process
+        max_workers (int): maximum number of concurrent calls
+
+    Yields:
+        Any: next result in the same order as items
+    """
+    max_workers = max(1, max_workers)
+    safe_call = partial(_safe_call, func)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+
+        for item in items:
+            pending.append(executor.submit(safe_call, item))
+
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def map_concurrent(func: Callable, items: Iterable, max_workers: int) -> list:
+    """Applies a function to every item on a thread pool.
+    Results keep the order of the input items. A failing call is
+    logged and yields None in its slot instead of failing the whole run.
+
+    Args:
+        func (Callable): function to apply to each item
+        items (Iterable): items to process
+        max_workers (int): maximum number of concurrent calls
+
+    Returns:
+        list: results in the same order as items
+    """
+    # Everything is submitted up front, so a slow call never idles the other workers
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(partial(_safe_call, func), items))
+
+
+def chunked(items: Iterable, size: int) -> Iterable[list]:
+    """Splits items into lists of at most size items.
+
+    Args:
+        items (Iterable): items to split
+        size (int): maximum size of a chunk
+
+    Yields:
+        list: next chunk of items
+    """
+    iterator = iter(items)
+
+    while chunk := list(islice(iterator, max(1, size))):
+        yield chunk
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident memory of the process so far.
+
+    Returns:
+        float: peak resident set size in megabytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def merge_history(
+    channels: list[ChannelRecord], history: dict[int, list[ShowRecord]]
+) -> None:
+    """Prepends stored shows to freshly scraped channels in place.
+    Stored shows that were scraped again are skipped.
+
+    Args:
+        channels (list[ChannelRecord]): scraped channels
+        history (dict[int, list[ShowRecord]]): stored shows grouped by channel id
+    """
+    for channel in channels:
+        stored = history.get(channel.oid)
+
+        if not stored:
+            continue
+
+        scraped = {show.start_ts for show in channel.shows}
+        channel.shows = [
+            show for show in stored if show.start_ts not in scraped
+        ] + channel.shows
+
+
+def flatten_shows(channels: list[ChannelRecord]) -> list[dict]:
+    """Flattens embedded shows of channels into standalone show documents.
+    Shows of channels listed more than once are only kept once.
+
+    Args:
+        channels (list[ChannelRecord]): list of channels
+
+    Returns:
+        list[dict]: raw show documents tagged with their provider
+    """
+    seen = set()
+    flat = []
 
     for channel in channels:
         for show in channel.shows:
-            dates.append(show.start_dt)
+            key = (channel.provider, show.oid, show.start_ts)
+
+            if key in seen:
+                continue
+
+            seen.add(key)
+            flat.append({**show.to_mongo(), "provider": channel.provider})
+
+    return flat
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns the shared process pool, creating it on first use.
+    Workers are spawned rather than forked, since scrapers run on threads.
+
+    Args:
+        workers (int): number of worker processes
+
+    Returns:
+        ProcessPoolExecutor: shared process pool
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def map_processes(func: Callable, items: list, workers: int) -> list:
+    """Applies a picklable function to every item on a process pool.
+    Items are sent in chunks sized so every worker gets a few of them,
+    small inputs are processed in the calling process.
+
+    Args:
+        func (Callable): picklable function to apply to each item
+        items (list): items to process
+        workers (int): number of worker processes
+
+    Returns:
+        list: results in the same order as items
+    """
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    chunk_size = max(MIN_CHUNK_SIZE, math.ceil(len(items) / (workers * 4)))
+
+    if len(items) < 2 * chunk_size:
+        return [func(item) for item in items]
+
+    pool = get_process_pool(workers)
+    return list(pool.map(func, items, chunksize=chunk_size))
+
+
+def run_isolated(tasks: dict[str, tuple[Callable, int]]) -> dict[str, Any]:
+    """Runs tasks concurrently on daemon threads, each with its own timeout.
+    A task that fails or stalls past its timeout is logged and yields None,
+    without blocking or discarding the results of the others.
+
+    Args:
+        tasks (dict[str, tuple[Callable, int]]): functions and timeouts in seconds by name
+
+    Returns:
+        dict[str, Any]: results by name, None for failed or timed out tasks
+    """
+    results = {name: None for name in tasks}
+    done = {name: threading.Event() for name in tasks}
+
+    def run(name: str, func: Callable) -> None:
+        try:
+            results[name] = func()
+        except Exception as err:
+            logging.error(f"{ name } failed: { err }", exc_info=True)
+        finally:
+            done[name].set()
+
+    start = time.monotonic()
+
+    for name, (func, _) in tasks.items():
+        threading.Thread(target=run, args=(name, func), daemon=True).start()
+
+    for name, (_, timeout) in tasks.items():
+        if not done[name].wait(max(0, start + timeout - time.monotonic())):
+            logging.error(f"{ name } timed out after { timeout } seconds")
+
+    return {name: results[name] if done[name].is_set() else None for name in tasks}
+
+
+def build_snapshots(channels: Iterable[ChannelRecord], tz: str = "Europe/Belgrade") -> list[dict]:
+    """Groups shows of channels into one document per day and category.
+    Every show is listed under each day it overlaps, so a day starts with
+    the show on air at midnight. Channels are additionally collected under
+    the ``constants.SNAPSHOT_ALL`` category, channels listed more than once
+    are only kept once per snapshot.
+
+    Args:
+        channels (Iterable[ChannelRecord]): channels with their shows
+        tz (str, optional): timezone days are counted in
+
+    Returns:
+        list[dict]: raw snapshot documents sorted by day and category
+    """
+    # Offsets only change on whole hours, so day starts are cached per hour
+    day_starts = {}
+
+    def day_of(ts: int) -> int:
+        hour = ts // 3600
+
+        if hour not in day_starts:
+            day_starts[hour] = (
+                pendulum.from_timestamp(ts, tz=tz).start_of("day").int_timestamp
+            )
+
+        return day_starts[hour]
+
+    snapshots = defaultdict(dict)
+
+    for channel in channels:
+        key = (channel.provider, channel.oid)
+        by_day = defaultdict(dict)
+
+        for show in channel.shows:
+            day = day_of(show.start_ts)
+            last = day_of(max(show.start_ts, show.end_ts - 1))
+            doc = show.to_mongo()
+            doc = {name: doc[name] for name in constants.SNAPSHOT_SHOW_FIELDS}
+
+            while True:
+                by_day[day][show.start_ts] = doc
+
+                if day >= last:
+                    break
+
+                # Next midnight is at most 25 hours away
+                day = day_of(day + 25 * 3600)
+
+        for day, shows in by_day.items():
+            entry = {
+                "oid": channel.oid,
+                "provider": channel.provider,
+                "name": channel.name,
+                "logo": channel.logo,
+                "shows": [shows[start] for start in sorted(shows)],
+            }
+
+            for category in [constants.SNAPSHOT_ALL, *channel.category]:
+                snapshot = snapshots[(day, category)]
+
+                # Keep the entry with most shows of a channel listed twice
+                if len(snapshot.get(key, {}).get("shows", ())) <= len(entry["shows"]):
+                    snapshot[key] = entry
+
+    return [
+        {"timestamp": day, "category": category, "channels": list(entries.values())}
+        for (day, category), entries in sorted(snapshots.items())
+    ]
+
+
+def normalize_name(name: str) -> str:
+    """Normalizes channel name so the same channel matches across providers.
+    Diacritics, punctuation, case and quality suffixes are ignored.
+
+    Args:
+        name (str): channel name
+
+    Returns:
+        str: normalized name
+    """
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    tokens = re.findall(r"[a-z0-9]+", ascii_name.lower())
+
+    while len(tokens) > 1 and tokens[-1] in constants.CHANNEL_NAME_SUFFIXES:
+        tokens.pop()
+
+    return " ".join(tokens)
+
+
+def show_richness(show: ShowRecord) -> tuple:
+    """Ranks how much information a show carries.
+
+    Args:
+        show (ShowRecord): show to rank
+
+    Returns:
+        tuple: rank, greater is richer
+    """
+    filled = sum(
+        1
+        for value in (show.title, show.description, show.category)
+        if value and value.strip()
+    )
+    has_poster = bool(show.poster) and show.poster != constants.DEFAULT_IMG
+    return (filled + has_poster, len(show.description or ""))
+
+
+def merge_shows(primary: list[ShowRecord], others: list[ShowRecord], oid: int) -> list[ShowRecord]:
+    """Merges show timelines with an interval sweep in O(n log n).
+    Shows overlapping by at least half of the shorter one fill the same slot,
+    only the richest of them is kept, primary shows win ties. Shows overlapping
+    by less are both kept, the poorer one is trimmed, so merged shows never overlap.
+
+    Args:
+        primary (list[ShowRecord]): shows of the channel that is kept
+        others (list[ShowRecord]): shows of duplicates of the channel
+        oid (int): channel id merged shows are assigned to
+
+    Returns:
+        list[ShowRecord]: merged shows sorted by start
+    """
+    ranked = [(show, (*show_richness(show), 1)) for show in primary]
+    ranked += [
+        (dataclasses.replace(show, oid=oid), (*show_richness(show), 0))
+        for show in others
+    ]
+    ranked.sort(key=lambda item: item[0].start_ts)
+    merged = []
+
+    for show, rank in ranked:
+        # Kept shows never overlap, so a replaced one is checked against the one before it
+        while merged:
+            last, last_rank = merged[-1]
+            overlap = min(last.end_ts, show.end_ts) - show.start_ts
+
+            if overlap <= 0:
+                break
+
+            shorter = min(last.end_ts - last.start_ts, show.end_ts - show.start_ts)
+
+            if overlap * 2 >= shorter:
+                if rank <= last_rank:
+                    show = None
+                    break
+
+                merged.pop()
+                continue
+
+            # Sorted by start, so a partially overlapping show ends after the last one
+            if rank > last_rank:
+                merged[-1] = (
+                    dataclasses.replace(
+                        last,
+                        end_ts=show.start_ts,
+                        end_dt=show.start_dt,
+                        duration=(show.start_ts - last.start_ts) / 60,
+                    ),
+                    last_rank,
+                )
+            else:
+                show = dataclasses.replace(
+                    show,
+                    start_ts=last.end_ts,
+                    start_dt=last.end_dt,
+                    duration=(show.end_ts - last.end_ts) / 60,
+                )
+            break
+
+        if show is not None:
+            merged.append((show, rank))
+
+    return [show for show, _ in merged]
+
+
+def merge_channels(channels: list[ChannelRecord]) -> tuple[list[ChannelRecord], dict]:
+    """Merges channels carried by more than one provider into a single one.
+    Channels are matched by normalized name. Copies of the channel with most
+    shows are kept and get the merged timeline, channels of other providers
+    with the same name are dropped.
+
+    Args:
+        channels (list[ChannelRecord]): channels of all providers
+
+    Returns:
+        tuple(list[ChannelRecord], dict): merged channels and counts of
+            removed channels and shows
+    """
+    groups = defaultdict(lambda: defaultdict(list))
+
+    for channel in channels:
+        groups[normalize_name(channel.name)][(channel.provider, channel.oid)].append(channel)
+
+    dropped = set()
+    counts = {"channels": 0, "shows": 0}
+
+    for name, copies in groups.items():
+        if len({provider for provider, _ in copies}) < 2:
+            continue
+
+        # Copies of a channel listed in several categories share their shows
+        key = max(copies, key=lambda k: len(copies[k][0].shows))
+        kept = copies[key]
+        duplicates = [k for k in copies if k[0] != key[0]]
+        others = [show for k in duplicates for show in copies[k][0].shows]
+        shows = merge_shows(kept[0].shows, others, key[1])
+
+        counts["channels"] += sum(len(copies[k]) for k in duplicates)
+        counts["shows"] += len(kept[0].shows) + len(others) - len(shows)
+        logging.info(
+            f"Merged { name } of { ', '.join(f'{ p }:{ o }' for p, o in duplicates) } "
+            f"into { key[0] }:{ key[1] }"
+        )
+
+        for channel in kept:
+            channel.shows = shows
 
-    min_date = min(dates)
-    max_date = max(dates)
+        dropped.update(duplicates)
 
-    logging.info(f"Min date is: {min_date} and max date is: {max_date}")
-    return (min_date, max_date)
+    merged = [c for c in channels if (c.provider, c.oid) not in dropped]
+    return (merged, counts)
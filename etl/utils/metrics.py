@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from decouple import config
+
+from utils import helpers
+
+
+class Metrics:
+    """Collects stage durations, request and record counts of an ETL run
+    and emits them as structured JSON and Prometheus text format."""
+
+    _lock = threading.Lock()
+    _started = time.perf_counter()
+    _stages = {}
+    _requests = {}
+
+    @staticmethod
+    def reset() -> None:
+        """Clear collected metrics and restart the run clock."""
+        with Metrics._lock:
+            Metrics._started = time.perf_counter()
+            Metrics._stages = {}
+            Metrics._requests = {}
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str, records: int = 0):
+        """Time a block of work and add it to the named stage.
+
+        Args:
+            name (str): Stage name
+            records (int, optional): Number of records processed in the block
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with Metrics._lock:
+                stage = Metrics._stages.setdefault(
+                    name, {"seconds": 0.0, "calls": 0, "records": 0}
+                )
+                stage["seconds"] += elapsed
+                stage["calls"] += 1
+                stage["records"] += records
+
+    @staticmethod
+    def record_response(response: requests.Response, *args, **kwargs) -> None:
+        """Requests response hook counting requests, bytes and time per endpoint.
+
+        Args:
+            response (requests.Response): Received response
+        """
+        endpoint = urlsplit(response.url).path
+
+        with Metrics._lock:
+            stats = Metrics._requests.setdefault(
+                endpoint, {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0}
+            )
+            stats["requests"] += 1
+            stats["errors"] += int(response.status_code >= 400)
+            stats["bytes"] += len(response.content)
+            stats["seconds"] += response.elapsed.total_seconds()
+
+    @staticmethod
+    def snapshot() -> dict:
+        """Get collected metrics.
+
+        Returns:
+            dict: Run duration, peak memory, stages and requests
+        """
+        with Metrics._lock:
+            return {
+                "timestamp": int(time.time()),
+                "seconds": round(time.perf_counter() - Metrics._started, 3),
+                "peak_rss_mb": round(helpers.peak_rss_mb(), 1),
+                "stages": {k: dict(v) for k, v in Metrics._stages.items()},
+                "requests": {k: dict(v) for k, v in Metrics._requests.items()},
+            }
+
+    @staticmethod
+    def to_prometheus(snapshot: dict) -> str:
+        """Render metrics snapshot in Prometheus text format.
+
+        Args:
+            snapshot (dict): Metrics snapshot
+
+        Returns:
+            str: Prometheus text exposition
+        """
+        lines = [
+            "# TYPE etl_run_seconds gauge",
+            f"etl_run_seconds { snapshot['seconds'] }",
+            "# TYPE etl_peak_rss_bytes gauge",
+            f"etl_peak_rss_bytes { int(snapshot['peak_rss_mb'] * 2**20) }",
+            "# TYPE etl_last_run_timestamp_seconds gauge",
+            f"etl_last_run_timestamp_seconds { snapshot['timestamp'] }",
+        ]
+
+        for metric, field, label in [
+            ("etl_stage_seconds", "seconds", "stages"),
+            ("etl_stage_calls", "calls", "stages"),
+            ("etl_stage_records", "records", "stages"),
+            ("etl_http_requests", "requests", "requests"),
+            ("etl_http_errors", "errors", "requests"),
+            ("etl_http_bytes", "bytes", "requests"),
+            ("etl_http_seconds", "seconds", "requests"),
+        ]:
+            key = "stage" if label == "stages" else "endpoint"
+            lines.append(f"# TYPE { metric } gauge")
+
+            for name, values in snapshot[label].items():
+                lines.append(f'{ metric }{{{ key }="{ name }"}} { values[field] }')
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write(path: str, content: str) -> None:
+        """Atomically replace file contents, so collectors never read a partial file."""
+        tmp_path = f"{ path }.tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(content)
+
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def emit() -> dict:
+        """Log metrics as JSON and write them to configured files.
+
+        Returns:
+            dict: Metrics snapshot
+        """
+        snapshot = Metrics.snapshot()
+        logging.info(f"Metrics: { json.dumps(snapshot) }")
+
+        try:
+            json_path = config("METRICS_JSON_PATH", default="")
+            prom_path = config("METRICS_PROM_PATH", default="")
+
+            if json_path:
+                Metrics.write(json_path, json.dumps(snapshot, indent=2))
+            if prom_path:
+                Metrics.write(prom_path, Metrics.to_prometheus(snapshot))
+        except Exception as err:
+            logging.error(err, exc_info=True)
+
+        return snapshot
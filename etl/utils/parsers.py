@@ -1,12 +1,19 @@
-from datetime import datetime
+import calendar
+import sys
+from datetime import date, datetime, timedelta
 
 import pendulum
-from orm.models import Channel, Date, Show
+from orm.models import Date
+from orm.records import ChannelRecord, ShowRecord
 
-from utils import constants
+from utils import constants, helpers
 
 
 class ParserMTS:
+    def __init__(self) -> None:
+        # UTC offsets of Europe/Belgrade keyed by (date, hour)
+        self._offsets = {}
+
     def get_image(self, url) -> str:
         """If there is no image, return default image.
 
@@ -22,9 +29,37 @@ class ParserMTS:
 
         return url
 
+    def get_offset(self, day: date, hour: int) -> tuple:
+        """Get Europe/Belgrade UTC offset for given day and hour.
+        Offsets are cached, keyed by hour as well so DST switch days stay correct.
+
+        Args:
+            day (date): Local date
+            hour (int): Local hour
+
+        Returns:
+            tuple: Tuple of UTC offset in seconds and matching fixed timezone,
+                None if the hour is skipped by the spring forward DST switch
+        """
+        key = (day, hour)
+
+        if key not in self._offsets:
+            local = pendulum.datetime(
+                day.year, day.month, day.day, hour, tz="Europe/Belgrade"
+            )
+            # Non-existent local times are normalized by pendulum, moving the hour
+            self._offsets[key] = (
+                (local.offset, pendulum.tz.fixed_timezone(local.offset))
+                if local.hour == hour
+                else None
+            )
+
+        return self._offsets[key]
+
     def parse_datetime(self, datetime_str) -> tuple:
         """Parse datetime string to datetime object with timezone.
-        It handles some edge cases where hours are 24:00 and not 00:00.
+        Expects the known mts layout "YYYY-MM-DD HH:MM[:SS]" and falls back
+        to generic parsing otherwise. Hour 24 rolls over to 00 of the next day.
 
         Args:
             datetime_str (str): Datetime string
@@ -32,14 +67,40 @@ class ParserMTS:
         Returns:
             tuple: Tuple of datetime object with timezone and unix timestamp
         """
-        chars = list(datetime_str)
-
-        if chars[11] == "2" and chars[12] == "4":
-            chars[11], chars[12] = "0", "0"
-
-        parsed = pendulum.parse("".join(chars), tz="Europe/Belgrade")
+        try:
+            day = date(
+                int(datetime_str[0:4]), int(datetime_str[5:7]), int(datetime_str[8:10])
+            )
+            hour = int(datetime_str[11:13])
+            minute = int(datetime_str[14:16])
+            second = int(datetime_str[17:19]) if len(datetime_str) >= 19 else 0
+        except ValueError:
+            parsed = pendulum.parse(datetime_str, tz="Europe/Belgrade")
+            return (parsed, int(parsed.timestamp()))
+
+        if hour == 24:
+            day += timedelta(days=1)
+            hour = 0
+
+        offset = self.get_offset(day, hour)
+
+        # Times in the DST gap are shifted forward the same way pendulum.parse does
+        if offset is None:
+            parsed = pendulum.datetime(
+                day.year, day.month, day.day, hour, minute, second, tz="Europe/Belgrade"
+            )
+            return (parsed, parsed.int_timestamp)
+
+        offset, tz = offset
+        parsed = pendulum.DateTime(
+            day.year, day.month, day.day, hour, minute, second, tzinfo=tz
+        )
+        timestamp = (
+            calendar.timegm((day.year, day.month, day.day, hour, minute, second))
+            - offset
+        )
 
-        return (parsed, int(parsed.timestamp()))
+        return (parsed, timestamp)
 
     def parse_categories(self, category_str: str) -> list[str]:
         """Parsing categories string to list of categories.
@@ -64,56 +125,61 @@ class ParserMTS:
         except:
             return []
 
-    def parse_show(self, item: dict) -> Show:
+    def parse_show(self, item: dict) -> ShowRecord:
         """Parsing show item from API to
-        :class:`etl.orm.models.Show` object.
+        :class:`etl.orm.records.ShowRecord` object.
 
         Args:
             item (dict): Show item from API
 
         Returns:
-            Show: Parsed Show object
+            ShowRecord: Parsed show record
         """
 
+        start_dt, start_ts = self.parse_datetime(item["full_start"])
+        end_dt, end_ts = self.parse_datetime(item["full_end"])
+
         args = {
             "title": item["title"],
-            "category": item["category"],
+            # Repeated values share a single string object
+            "category": sys.intern(item["category"]) if item["category"] else item["category"],
             "description": item["description"],
-            "start_dt": self.parse_datetime(item["full_start"])[0],
-            "end_dt": self.parse_datetime(item["full_end"])[0],
-            "start_ts": self.parse_datetime(item["full_start"])[1],
-            "end_ts": self.parse_datetime(item["full_end"])[1],
+            "start_dt": start_dt,
+            "end_dt": end_dt,
+            "start_ts": start_ts,
+            "end_ts": end_ts,
             "duration": float(item["duration"]),
-            "poster": self.get_image(item["image"]),
+            "poster": sys.intern(self.get_image(item["image"])),
             "oid": int(item.get("id_channel", 0)),
         }
 
-        return Show(**args)
+        return ShowRecord(**args)
 
-    def parse_channel(self, item: dict, shows: list[Show]) -> Channel:
+    def parse_channel(self, item: dict, shows: list[ShowRecord]) -> ChannelRecord:
         """Parsing channel item from API to
-        :class:`etl.orm.models.Channel` object.
+        :class:`etl.orm.records.ChannelRecord` object.
 
         Args:
             item (dict): Channel item from API
-            shows: (list[Show]): List of shows for channel
+            shows: (list[ShowRecord]): List of shows for channel
 
         Returns:
-            Channel: Parsed Channel object
+            ChannelRecord: Parsed channel record
         """
         args = {
             "oid": int(item["id"]),
+            "provider": "mts",
             "name": item["name"].strip(),
             "logo": item["image"],
             "category": self.parse_categories(item["category"]),
             "shows": shows,
         }
 
-        return Channel(**args)
+        return ChannelRecord(**args)
 
 
 class ParserSBB:
-    """Class for parsing response objects from SBB API to ORM instances"""
+    """Class for parsing response objects from SBB API to records"""
 
     def __init__(self) -> None:
         self.image_base_url = "https://images-web.ug-be.cdn.united.cloud"
@@ -136,15 +202,16 @@ class ParserSBB:
 
         return constants.DEFAULT_IMG
 
-    def parse_channel(self, item: dict, shows: list[Show]) -> Channel:
+    def parse_channel(self, item: dict, shows: list[ShowRecord]) -> ChannelRecord:
         """Parsing channel item from API to
-        :class:`etl.models.channel.Channel` object.
+        :class:`etl.orm.records.ChannelRecord` object.
 
         Args:
             item (dict): Channel item from API
+            shows: (list[ShowRecord]): List of shows for channel
 
         Returns:
-            Channel: Parsed Channel object
+            ChannelRecord: Parsed channel record
         """
         # Handle categories for SK and N1 & Nova channels
         category = (
@@ -153,23 +220,24 @@ class ParserSBB:
 
         args = {
             "oid": item["id"],
+            "provider": "sbb",
             "name": item["name"].strip(),
             "logo": self.image_base_url + item["images"][0]["path"],
             "category": category,
             "shows": shows,
         }
 
-        return Channel(**args)
+        return ChannelRecord(**args)
 
-    def parse_show(self, item: dict) -> Show:
+    def parse_show(self, item: dict) -> ShowRecord:
         """Parsing show item from API to
-        :class:`etl.models.show.Show` object.
+        :class:`etl.orm.records.ShowRecord` object.
 
         Args:
             item (dict): Show item from API
 
         Returns:
-            Show: Parsed Show object
+            ShowRecord: Parsed show record
         """
         args = {
             "title": item["title"],
@@ -181,14 +249,15 @@ class ParserSBB:
             "end_dt": pendulum.from_timestamp(
                 item["endTime"] / 1000, tz="Europe/Belgrade"
             ),
-            "start_ts": item["startTime"] / 1000,
-            "end_ts": item["endTime"] / 1000,
+            "start_ts": item["startTime"] // 1000,
+            "end_ts": item["endTime"] // 1000,
             "duration": float((item["endTime"] - item["startTime"]) / 1000 / 60),
-            "poster": self.get_image(item["images"]),
+            # Repeated values share a single string object
+            "poster": sys.intern(self.get_image(item["images"])),
             "oid": item["channelId"],
         }
 
-        return Show(**args)
+        return ShowRecord(**args)
 
 
 class DateParser:
@@ -202,11 +271,26 @@ class DateParser:
         Returns:
             Date: Parsed Date object
         """
+        # Single format call for all fields
+        weekday, month, day = date.format("dddd|MMMM|D").split("|")
         args = {
             "date_tz": date,
             "timestamp": int(date.timestamp()),
-            "weekday": date.format("dddd"),
-            "month": date.format("MMMM"),
-            "day": int(date.format("D")),
+            "weekday": weekday,
+            "month": month,
+            "day": int(day),
         }
         return Date(**args)
+
+    @staticmethod
+    def parse_range(start_ts: int, end_ts: int) -> list[Date]:
+        """Parsing all days overlapping the interval to Date objects.
+
+        Args:
+            start_ts (int): Start unix timestamp
+            end_ts (int): End unix timestamp, exclusive
+
+        Returns:
+            list[Date]: Parsed Date objects, first to last
+        """
+        return [DateParser.parse(date) for date in helpers.daterange(start_ts, end_ts)]
@@ -0,0 +1,163 @@
+import json
+import logging
+from datetime import timedelta
+from operator import attrgetter
+
+from decouple import config
+from orm.records import ChannelRecord, ShowRecord
+
+from utils import helpers
+from utils.metrics import Metrics
+
+DAY = 24 * 60 * 60
+
+
+class Validator:
+    """Checks parsed schedules for malformed, duplicate, overlapping
+    and missing slots, flags them and optionally repairs them."""
+
+    # off | flag | repair
+    _MODE = config("VALIDATE_SCHEDULES", default="off")
+    _GAP_TOLERANCE = config("SCHEDULE_GAP_TOLERANCE", default=60, cast=int)
+    _REPORT_PATH = config("SCHEDULE_REPORT_PATH", default="")
+
+    @staticmethod
+    def enabled() -> bool:
+        return Validator._MODE in ("flag", "repair")
+
+    @staticmethod
+    def set_end(show: ShowRecord, end_ts: int, end_dt) -> None:
+        """Move end of show, keeping its duration in minutes in sync."""
+        show.end_ts = end_ts
+        show.end_dt = end_dt
+        show.duration = (end_ts - show.start_ts) / 60
+
+    @staticmethod
+    def is_rollover(show: ShowRecord) -> bool:
+        """Check whether show ends at local midnight of its own day,
+        meaning 24:00 was parsed as the start of the day instead of the end."""
+        end = show.end_dt
+        return (
+            show.end_ts < show.start_ts < show.end_ts + DAY
+            and (end.hour, end.minute, end.second) == (0, 0, 0)
+        )
+
+    @staticmethod
+    def check(shows: list[ShowRecord], repair: bool = False) -> tuple[list[ShowRecord], dict]:
+        """Sort shows of a channel once and check them in a single linear sweep.
+
+        Shows ending before they start are flagged as invalid, ones ending at
+        local midnight of their own day are a missed 24:00 rollover and are moved
+        a day forward, others are extended up to the next show or dropped. Shows starting together are duplicates,
+        only the richest one is kept. Overlapping shows are trimmed to the start
+        of the next one, gaps longer than the tolerance are flagged only.
+
+        Args:
+            shows (list[ShowRecord]): Shows of a channel
+            repair (bool, optional): Repair found issues, otherwise only count them
+
+        Returns:
+            tuple(list[ShowRecord], dict): Checked shows and issue counts
+        """
+        counts = {
+            "shows": len(shows),
+            "invalid": 0,
+            "rollovers": 0,
+            "duplicates": 0,
+            "overlaps": 0,
+            "gaps": 0,
+            "gap_seconds": 0,
+            "dropped": 0,
+        }
+        # Timsort is linear on the already sorted lists parsers produce
+        ordered = sorted(shows, key=attrgetter("start_ts"))
+        kept = []
+
+        for i, show in enumerate(ordered):
+            if show.end_ts <= show.start_ts or show.duration <= 0:
+                counts["invalid"] += 1
+
+                if repair and Validator.is_rollover(show):
+                    counts["rollovers"] += 1
+                    Validator.set_end(show, show.end_ts + DAY, show.end_dt + timedelta(days=1))
+                elif repair and show.end_ts > show.start_ts:
+                    Validator.set_end(show, show.end_ts, show.end_dt)
+                elif repair and i + 1 < len(ordered) and ordered[i + 1].start_ts > show.start_ts:
+                    following = ordered[i + 1]
+                    Validator.set_end(show, following.start_ts, following.start_dt)
+                elif repair:
+                    counts["dropped"] += 1
+                    continue
+
+            if kept:
+                previous = kept[-1]
+
+                if show.start_ts == previous.start_ts:
+                    counts["duplicates"] += 1
+
+                    if repair:
+                        counts["dropped"] += 1
+
+                        if helpers.show_richness(show) > helpers.show_richness(previous):
+                            kept[-1] = show
+                        continue
+                elif show.start_ts < previous.end_ts:
+                    counts["overlaps"] += 1
+
+                    if repair:
+                        Validator.set_end(previous, show.start_ts, show.start_dt)
+                elif show.start_ts - previous.end_ts > Validator._GAP_TOLERANCE:
+                    counts["gaps"] += 1
+                    counts["gap_seconds"] += show.start_ts - previous.end_ts
+
+            kept.append(show)
+
+        return (kept if repair else shows, counts)
+
+    @staticmethod
+    def validate(channels: list[ChannelRecord]) -> list[dict]:
+        """Check schedules of all channels and build a per-channel quality report.
+        Shows are repaired in place if VALIDATE_SCHEDULES is repair.
+
+        Args:
+            channels (list[ChannelRecord]): Channels with their shows
+
+        Returns:
+            list[dict]: Issue counts of every channel
+        """
+        repair = Validator._MODE == "repair"
+        # Copies of a channel listed in several categories share their shows
+        checked = {}
+        report = {}
+
+        with Metrics.stage("validate", len(channels)):
+            for channel in channels:
+                key = id(channel.shows)
+
+                if key not in checked:
+                    checked[key] = Validator.check(channel.shows, repair)
+
+                shows, counts = checked[key]
+                channel.shows = shows
+                report[(channel.provider, channel.oid)] = {
+                    "provider": channel.provider,
+                    "oid": channel.oid,
+                    "name": channel.name,
+                    **counts,
+                }
+
+        report = list(report.values())
+        totals = {
+            name: sum(row[name] for row in report)
+            for name in ("shows", "invalid", "rollovers", "duplicates", "overlaps", "gaps", "dropped")
+        }
+        flagged = sum(1 for row in report if row["invalid"] or row["duplicates"] or row["overlaps"])
+        logging.info(f"Schedules of { len(report) } channels checked, { flagged } flagged: { totals }")
+
+        if Validator._REPORT_PATH:
+            try:
+                Metrics.write(Validator._REPORT_PATH, json.dumps(report, indent=2))
+            except Exception as err:
+                logging.error(err, exc_info=True)
+
+        return report